@@ -1,20 +1,57 @@
 import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+
+# Local settings, before the modules below read the environment; the
+# deployed app has none and skips importing python-dotenv
+if os.path.exists('.env'):
+    from dotenv import load_dotenv
+    load_dotenv('.env')
+
+from flask import Flask, request, abort
 from flask_cors import CORS
-from models import setup_db, db_drop_and_create_all, Shelter, Animal
+from sqlalchemy.orm import joinedload, selectinload
+from models import (setup_db, db_drop_and_create_all, on_catalog_change,
+                    db, Shelter, Animal)
 from auth.auth import requires_auth, AuthError
+from pagination import get_page_args, paginate, wants_total
+from filters import filter_animals
+from streaming import stream_collection, wants_stream
+from conditional import Validators, table_versions
+from metrics import setup_metrics
+from validation import (coordinate_errors, validate_animal, validate_ids,
+                        validate_items, validate_shelter)
+from cache import (cached_response, invalidate_response_cache,
+                   setup_response_cache)
+from replicas import on_database_use, read_only
+from stats import animal_stats
+from search import search_catalog
+from nearby import nearby_shelters
+from fieldsets import get_fields, project, row_formatter, trim
+from serialization import jsonify, setup_serialization
+from compression import setup_compression
+from ratelimit import hold_load_shed_slot, setup_rate_limit
+
+on_catalog_change(invalidate_response_cache)
+on_database_use(hold_load_shed_slot)
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    if test_config is not None:
+        # Read by the setup functions below before the environment
+        app.config.from_mapping(test_config)
     setup_db(app)
 
     #db_drop_and_create_all()
 
     CORS(app, resources={r"/*": {"origins": "*"}})
 
+    setup_serialization(app)
+    setup_response_cache(app)
+    setup_compression(app)
+    setup_metrics(app)
+    setup_rate_limit(app)
+
 
     # Endpoints #
 
@@ -27,58 +64,173 @@ def create_app(test_config=None):
 
     # Get shelters
     @app.route('/shelters', methods=['GET'])
+    @cached_response
+    @read_only
     def get_shelters():
-        shelters = Shelter.query.all()
-        formatted_shelters = [shelter.format() for shelter in shelters]
+        limit, after_id = get_page_args(request.args)
+        include = request.args.get('include', '')
+        if include not in ('', 'animals'):
+            abort(400)
+        include_animals = include == 'animals'
+        fields = get_fields(request.args, Shelter)
+
+        query = Shelter.query
+        page_query = query
+        format_shelter = Shelter.format
+        if include_animals:
+            # One extra SELECT ... WHERE shelter_id IN (...) for the page
+            page_query = query.options(selectinload(Shelter.animals))
+
+            def format_shelter(shelter):
+                formatted = shelter.format(include_animals=True)
+                if fields:
+                    formatted = trim(formatted, fields, ('animals',))
+                return formatted
+        elif fields:
+            page_query = project(query, Shelter, fields)
+            format_shelter = row_formatter(fields)
+
+        validators = Validators(*table_versions(
+            *([Shelter, Animal] if include_animals else [Shelter])))
+        if validators.is_fresh():
+            return validators.not_modified()
+
+        if wants_stream(request.args):
+            return validators.apply(stream_collection(
+                'shelters', page_query.order_by(Shelter.id), format_shelter))
+
+        shelters, next_cursor = paginate(page_query, Shelter.id, limit,
+                                         after_id)
+        formatted_shelters = [format_shelter(shelter) for shelter in shelters]
+
+        response = {
+            'success': True,
+            'shelters': formatted_shelters,
+            'next_cursor': next_cursor
+        }
+        if wants_total(request.args):
+            response['total_shelters'] = query.order_by(None).count()
+
+        return validators.apply(jsonify(response)), 200
+
+    # Shelters closest to a point
+    @app.route('/shelters/nearby', methods=['GET'])
+    @cached_response
+    @read_only
+    def get_nearby_shelters():
+        shelters = nearby_shelters(request.args)
 
         return jsonify({
             'success': True,
-            'shelters': formatted_shelters,
-            'total_shelters': len(formatted_shelters)
+            'shelters': shelters,
+            'total_shelters': len(shelters)
         }), 200
 
     # Get animals
     @app.route('/animals', methods=['GET'])
+    @cached_response
+    @read_only
     def get_movies():
-        animals = Animal.query.all()
-        formatted_animals = [animal.format() for animal in animals]
+        query = filter_animals(Animal.query, request.args)
+        limit, after_id = get_page_args(request.args)
+        fields = get_fields(request.args, Animal)
 
-        return jsonify({
+        validators = Validators(*table_versions(Animal))
+        if validators.is_fresh():
+            return validators.not_modified()
+
+        page_query = query
+        format_animal = Animal.format
+        if fields:
+            page_query = project(query, Animal, fields)
+            format_animal = row_formatter(fields)
+
+        if wants_stream(request.args):
+            return validators.apply(stream_collection(
+                'animals', page_query.order_by(Animal.id), format_animal))
+
+        animals, next_cursor = paginate(page_query, Animal.id, limit,
+                                        after_id)
+        formatted_animals = [format_animal(animal) for animal in animals]
+
+        response = {
             'success': True,
             'animals': formatted_animals,
-            'total_animals': len(formatted_animals)
-        }), 200
+            'next_cursor': next_cursor
+        }
+        if wants_total(request.args):
+            response['total_animals'] = query.order_by(None).count()
+
+        return validators.apply(jsonify(response)), 200
 
     # Get all animals by shelter
     @app.route('/shelters/<int:shelter_id>/animals', methods=['GET'])
+    @cached_response
+    @read_only
     def get_specific_shelter_animals(shelter_id):
-        shelter = Shelter.query.get(shelter_id)
-        animals = Animal.query.filter(Animal.shelter_id == shelter_id).all()
+        validators = Validators(*table_versions(Shelter, Animal))
+        if validators.is_fresh():
+            return validators.not_modified()
+
+        fields = get_fields(request.args, Animal)
+        if fields:
+            shelter = Shelter.query.get(shelter_id)
+            animals = project(Animal.query, Animal, fields) \
+                .filter(Animal.shelter_id == shelter_id) \
+                .order_by(Animal.id).all()
+            format_animal = row_formatter(fields)
+        else:
+            shelter = Shelter.query.options(joinedload(Shelter.animals)) \
+                .filter(Shelter.id == shelter_id).one_or_none()
+            animals = shelter.animals if shelter is not None else []
+            format_animal = Animal.format
 
-        if len(animals) == 0:
+        if shelter is None:
             abort(404)
 
-        formatted_animals = [animal.format() for animal in animals]
+        formatted_animals = [format_animal(animal) for animal in animals]
         formatted_shelters = shelter.format()
 
-        return jsonify({
+        return validators.apply(jsonify({
             'success': True,
             'animals': formatted_animals,
-            'total_animals': len(animals),
+            'total_animals': len(formatted_animals),
             'shelters': formatted_shelters,
             'current_shelter': shelter_id
-        }), 200
+        })), 200
+
+    # Full-text search over animals and shelters
+    @app.route('/search', methods=['GET'])
+    @cached_response
+    @read_only
+    def search():
+        results = search_catalog(request.args)
+
+        return jsonify(dict(success=True, **results)), 200
+
+    # Animal counts by shelter, species, breed and age bucket
+    @app.route('/stats', methods=['GET'])
+    @cached_response
+    @read_only
+    def get_stats():
+        stats = animal_stats(request.args)
+
+        return jsonify(dict(success=True, **stats)), 200
 
     # Delete shelter - Domain Admin 
     @app.route('/shelters/<int:shelter_id>', methods=['DELETE'])
     @requires_auth('delete:shelters')
     def delete_shelter(payload, shelter_id):
+        cascade = request.args.get('cascade', '').lower()
+        if cascade not in ('', 'true', 'false'):
+            abort(400)
+
         shelter = Shelter.query.get(shelter_id)
 
         if shelter is None:
             abort(400)
 
-        shelter.delete()
+        shelter.delete(cascade=cascade == 'true')
 
         return jsonify({
             'success': True,
@@ -103,6 +255,48 @@ def create_app(test_config=None):
             'deleted': animal_id
         }), 200
 
+    # Delete animals in one statement - Domain Admin/Shelter Manager
+    @app.route('/animals', methods=['DELETE'])
+    @requires_auth('delete:animals')
+    def delete_animals(payload):
+        animal_ids = validate_ids(request.args.get('ids', ''))
+        if animal_ids is None:
+            abort(400)
+
+        deleted = Animal.delete_many(animal_ids)
+
+        return jsonify({
+            'success': True,
+            'deleted': deleted,
+            'not_found': sorted(set(animal_ids) - set(deleted))
+        }), 200
+
+    # Move animals to another shelter in one statement - Domain
+    # Admin/Animal Specialist
+    @app.route('/animals/transfer', methods=['POST'])
+    @requires_auth('patch:animals')
+    def transfer_animals(payload):
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            abort(400)
+        animal_ids = validate_ids(data.get('animal_ids'))
+        shelter_id = data.get('shelter_id')
+        if animal_ids is None or not isinstance(shelter_id, int) or \
+                isinstance(shelter_id, bool):
+            abort(400)
+
+        if Shelter.query.get(shelter_id) is None:
+            abort(422)
+
+        transferred = Animal.transfer(animal_ids, shelter_id)
+
+        return jsonify({
+            'success': True,
+            'shelter_id': shelter_id,
+            'transferred': transferred,
+            'not_found': sorted(set(animal_ids) - set(transferred))
+        }), 200
+
     # Create shelter - Domain Admin
     @app.route('/shelters', methods=['POST'])
     @requires_auth('post:shelters')
@@ -116,17 +310,23 @@ def create_app(test_config=None):
             state = data.get('state')
             address = data.get('address')
             phone = data.get('phone')
+            latitude = data.get('latitude')
+            longitude = data.get('longitude')
 
             if ((name == '') or (city == '') or
                     (state == '') or (address =='')):
                 abort(422)
+            if coordinate_errors(latitude, longitude):
+                abort(422)
 
             shelter = Shelter(
                 name=name,
                 city=city,
                 state=state,
                 address=address,
-                phone=phone
+                phone=phone,
+                latitude=latitude,
+                longitude=longitude
             )
             shelter.insert()
         except BaseException as e:
@@ -179,6 +379,68 @@ def create_app(test_config=None):
             'animals': formatted_animals
         }), 200
 
+    # Create shelters in bulk - Domain Admin
+    @app.route('/shelters/bulk', methods=['POST'])
+    @requires_auth('post:shelters')
+    def post_shelters_bulk(payload):
+        rows, errors = validate_items(request.get_json(silent=True),
+                                      validate_shelter)
+        if rows is None:
+            abort(400)
+
+        return bulk_create(Shelter, rows, errors)
+
+    # Create animals in bulk - Domain Admin/Shelter Manager
+    @app.route('/animals/bulk', methods=['POST'])
+    @requires_auth('post:animals')
+    def post_animals_bulk(payload):
+        rows, errors = validate_items(request.get_json(silent=True),
+                                      validate_animal)
+        if rows is None:
+            abort(400)
+
+        # One query to check every referenced shelter exists
+        shelter_ids = {values['shelter_id'] for _, values in rows
+                       if values['shelter_id'] is not None}
+        known_ids = {shelter_id for shelter_id, in Shelter.query
+                     .with_entities(Shelter.id)
+                     .filter(Shelter.id.in_(shelter_ids))} \
+            if shelter_ids else set()
+        valid_rows = []
+        for index, values in rows:
+            if values['shelter_id'] is None or \
+                    values['shelter_id'] in known_ids:
+                valid_rows.append((index, values))
+            else:
+                errors.append({'index': index, 'errors': {
+                    'shelter_id': 'Shelter not found.'}})
+        errors.sort(key=lambda error: error['index'])
+
+        return bulk_create(Animal, valid_rows, errors)
+
+    def bulk_create(model, rows, errors):
+        if not rows:
+            return jsonify({
+                'success': False,
+                'error': 422,
+                'message': 'Unprocessable entity',
+                'errors': errors
+            }), 422
+
+        try:
+            model.bulk_insert([values for _, values in rows])
+        except BaseException as e:
+            print(e)
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'total_created': len(rows),
+            'created_indexes': [index for index, _ in rows],
+            'errors': errors
+        }), 200
+
     # Update shelter - Domain Admin/Shelter Manager
     @app.route('/shelters/<int:shelter_id>', methods=['PATCH'])
     @requires_auth('patch:shelters')
@@ -196,6 +458,8 @@ def create_app(test_config=None):
             update_state = data.get('state', None)
             update_address = data.get('address', None)
             update_phone = data.get('phone', None)
+            update_latitude = data.get('latitude', None)
+            update_longitude = data.get('longitude', None)
 
             if update_name:
                 updated_shelter.name = update_name
@@ -207,6 +471,11 @@ def create_app(test_config=None):
                 updated_shelter.address = update_address
             if update_phone:
                 updated_shelter.phone = update_phone
+            if update_latitude is not None or update_longitude is not None:
+                if coordinate_errors(update_latitude, update_longitude):
+                    abort(422)
+                updated_shelter.latitude = update_latitude
+                updated_shelter.longitude = update_longitude
 
             updated_shelter.update()
         except BaseException as e:
@@ -303,6 +572,17 @@ def create_app(test_config=None):
             'message': 'Unprocessable entity'
         }), 422
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = jsonify({
+            'success': False,
+            'error': 429,
+            'message': 'Too many requests'
+        })
+        if getattr(error, 'retry_after', None) is not None:
+            response.headers['Retry-After'] = error.retry_after
+        return response, 429
+
     @app.errorhandler(500)
     def internal_server_error(error):
         return jsonify({
@@ -311,9 +591,35 @@ def create_app(test_config=None):
             'message': 'Internal server error'
         }), 500
 
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        response = jsonify({
+            'success': False,
+            'error': 503,
+            'message': 'Service unavailable'
+        })
+        if getattr(error, 'retry_after', None) is not None:
+            response.headers['Retry-After'] = error.retry_after
+        return response, 503
+
     return app
 
-APP = create_app()
+
+'''
+APP
+    the application served by `gunicorn app:APP`, built on first access
+    rather than on import, so tools that only need create_app or the
+    models do not pay for it
+'''
+
+
+def __getattr__(name):
+    if name == 'APP':
+        app = globals()['APP'] = create_app()
+        return app
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
+
 
 if __name__ == '__main__':
-    APP.run(host='0.0.0.0', port=8080, debug=True)
+    create_app().run(host='0.0.0.0', port=8080, debug=True)
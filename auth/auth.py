@@ -3,15 +3,23 @@ import os
 import sys
 from flask import request, _request_ctx_stack
 from functools import wraps
-from jose import jwt
-from urllib.request import urlopen
 from os import environ
+from auth.jwks import JWKSUnavailable, key_store_from_env
+from auth.token_cache import token_cache_from_env
+from metrics import timed_auth_step
+from ratelimit import check_rate_limit
 
 
 AUTH0_DOMAIN = 'kdterrell-udacity.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'capstone'
 
+# Signing keys are cached in-process, see auth/jwks.py
+jwks = key_store_from_env(AUTH0_DOMAIN)
+
+# Tokens that already passed verification, see auth/token_cache.py
+token_cache = token_cache_from_env()
+
 # AuthError Exception
 '''
 AuthError Exception
@@ -73,17 +81,20 @@ def get_token_auth_header():
         !!NOTE check your RBAC settings in Auth0
     it should raise an AuthError if the requested permission string is not in
     the payload permissions array return true otherwise
+        granted: optional precomputed set of the payload permissions
 '''
 
 
-def check_permissions(permission, payload):
-    if 'permissions' not in payload:
-        raise AuthError({
-            'code': 'invalid_claims',
-            'description': 'Permissions not included in JWT.'
-        }, 400)
+def check_permissions(permission, payload, granted=None):
+    if granted is None:
+        if 'permissions' not in payload:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Permissions not included in JWT.'
+            }, 400)
+        granted = frozenset(payload['permissions'])
 
-    if permission not in payload['permissions']:
+    if permission not in granted:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -95,6 +106,7 @@ def check_permissions(permission, payload):
         token: a json web token (string)
     it should be an Auth0 token with key id (kid)
     it should verify the token using Auth0 /.well-known/jwks.json
+        the keys are served from the in-process `jwks` key store
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -105,26 +117,30 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
-
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    # Imported on first use, it adds to every worker's start up
+    from jose import jwt
+
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.JWTError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 401)
+
+    try:
+        rsa_key = jwks.get_key(unverified_header.get('kid'))
+    except JWKSUnavailable:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 503)
 
     if rsa_key:
         try:
             payload = jwt.decode(
                 token,
-                rsa_key,
+                (rsa_key,),
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
                 issuer=f'https://{AUTH0_DOMAIN}/'
@@ -150,6 +166,20 @@ def verify_decode_jwt(token):
         'description': 'Unable to find appropriate key.'
         }, 401)
 
+'''
+verify_token(token)
+    like verify_decode_jwt, but a token that was already verified is served
+    from `token_cache` until it expires
+    returns a VerifiedToken (payload, permissions, expires_at)
+'''
+
+
+def verify_token(token):
+    verified = token_cache.get(token)
+    if verified is None:
+        verified = token_cache.put(token, verify_decode_jwt(token))
+    return verified
+
 '''
 @TODO implement @requires_auth(permission) decorator method
     @INPUTS
@@ -159,6 +189,7 @@ def verify_decode_jwt(token):
     it should use the check_permissions method validate claims and check the
     requested permission return the decorator which passes the decoded payload
     to the decorated method
+    the route's rate limit is then applied to the token's `sub`
 '''
 
 
@@ -166,10 +197,17 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
-
+            with timed_auth_step('header'):
+                token = get_token_auth_header()
+            with timed_auth_step('verify'):
+                verified = verify_token(token)
+            with timed_auth_step('permissions'):
+                check_permissions(permission, verified.payload,
+                                  verified.permissions)
+            check_rate_limit(verified.payload.get('sub'))
+            return f(verified.payload, *args, **kwargs)
+
+        # The rate limiter leaves these to the check above, see ratelimit.py
+        wrapper.requires_auth = True
         return wrapper
     return requires_auth_decorator
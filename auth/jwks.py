@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+
+logger = logging.getLogger(__name__)
+
+'''
+JWKSKeyStore
+    keeps the signing keys of the identity provider in memory so that
+    verifying a token does not cost an outbound HTTPS round trip.
+
+    - keys are parsed once into RSA public key objects
+    - after `ttl` seconds the keys are refreshed on a background thread
+      while the current keys keep being served
+    - an unknown `kid` forces a synchronous refetch, at most once every
+      `min_refresh_interval` seconds, so a flood of tokens with a bogus
+      `kid` cannot hammer the identity provider
+    - every fetch, failed or not, counts towards that interval, so while
+      the identity provider is down the current keys keep being served
+      and it is retried once per interval, not once per request
+    - `source` may be an https:// or file:// URL or a plain file path,
+      which makes it possible to verify tokens without the network
+'''
+
+
+class JWKSKeyStore:
+
+    def __init__(self, source, ttl=600, min_refresh_interval=30,
+                 fetch_timeout=5, clock=time.monotonic):
+        self.source = source
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.fetch_timeout = fetch_timeout
+        self.clock = clock
+
+        self._keys = {}
+        self._loaded_at = None
+        self._last_attempt = None
+        self._fetch_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+
+    def get_key(self, kid):
+        '''
+        Return the public key for `kid`, or None if the identity provider
+        does not publish it. Raises JWKSUnavailable if the keys have never
+        been loaded and cannot be fetched.
+        '''
+        if self._loaded_at is None:
+            self.refresh()
+        elif self.clock() - self._loaded_at > self.ttl and \
+                self._may_force_refresh():
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._may_force_refresh():
+            self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self):
+        with self._fetch_lock:
+            self._last_attempt = self.clock()
+            try:
+                keys = parse_jwks(self._fetch())
+            except Exception as e:
+                if self._loaded_at is None:
+                    raise JWKSUnavailable(str(e)) from e
+                logger.warning('JWKS refresh from %s failed: %s',
+                               self.source, e)
+                return
+            self._keys = keys
+            self._loaded_at = self.clock()
+
+    def clear(self):
+        with self._fetch_lock:
+            self._keys = {}
+            self._loaded_at = None
+            self._last_attempt = None
+
+    def _may_force_refresh(self):
+        return (self._last_attempt is None or
+                self.clock() - self._last_attempt >=
+                self.min_refresh_interval)
+
+    def _refresh_in_background(self):
+        with self._refresh_lock:
+            if self._refresh_thread is not None and \
+                    self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(
+                target=self.refresh, name='jwks-refresh', daemon=True)
+            self._refresh_thread.start()
+
+    def _fetch(self):
+        if not urlparse(self.source).scheme:
+            with open(self.source) as f:
+                return json.load(f)
+        with urlopen(self.source, timeout=self.fetch_timeout) as response:
+            return json.loads(response.read())
+
+
+class JWKSUnavailable(Exception):
+    pass
+
+
+'''
+parse_jwks(jwks)
+    turns a JWK set into a {kid: RSA public key} mapping, skipping keys
+    that cannot be used to verify RS256 signatures
+'''
+
+
+def parse_jwks(jwks):
+    # Imported on first use, they add to every worker's start up
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
+    from jose.utils import base64_to_long
+
+    keys = {}
+    for key in jwks['keys']:
+        if key.get('kty') != 'RSA' or key.get('use', 'sig') != 'sig':
+            continue
+        if 'kid' not in key:
+            continue
+        numbers = RSAPublicNumbers(base64_to_long(key['e']),
+                                   base64_to_long(key['n']))
+        keys[key['kid']] = numbers.public_key(default_backend())
+    return keys
+
+
+def key_store_from_env(auth0_domain):
+    return JWKSKeyStore(
+        os.environ.get('JWKS_URL',
+                       f'https://{auth0_domain}/.well-known/jwks.json'),
+        ttl=float(os.environ.get('JWKS_CACHE_TTL', 600)),
+        min_refresh_interval=float(
+            os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30)),
+        fetch_timeout=float(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+    )
@@ -0,0 +1,78 @@
+import json
+import time
+import uuid
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+from jose.utils import long_to_base64
+
+from auth.auth import ALGORITHMS, API_AUDIENCE, AUTH0_DOMAIN
+
+
+'''
+LocalSigner
+    an offline stand-in for Auth0: a locally generated RSA key pair whose
+    public half is published as a JWKS file, and RS256 tokens signed with
+    the private half. Point JWKS_URL (or the `jwks` key store) at the file
+    and requires_auth verifies the tokens exactly as it verifies Auth0's.
+'''
+
+ROLE_PERMISSIONS = {
+    'domain_admin': ['delete:animals', 'delete:shelters', 'patch:animals',
+                     'patch:shelters', 'post:animals', 'post:shelters'],
+    'shelter_manager': ['delete:animals', 'patch:shelters', 'post:animals'],
+    'animal_specialist': ['patch:animals']
+}
+
+
+class LocalSigner:
+
+    def __init__(self, kid=None):
+        self.kid = kid or uuid.uuid4().hex
+        self._private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048, backend=default_backend())
+        self._private_pem = self._private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption())
+
+    def jwks(self):
+        numbers = self._private_key.public_key().public_numbers()
+        return {'keys': [{
+            'kty': 'RSA',
+            'kid': self.kid,
+            'use': 'sig',
+            'alg': ALGORITHMS[0],
+            'n': long_to_base64(numbers.n).decode('ascii'),
+            'e': long_to_base64(numbers.e).decode('ascii')
+        }]}
+
+    def write_jwks(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.jwks(), f)
+        return path
+
+    def install(self, key_store, path):
+        '''Point `key_store` at this signer's JWKS written to `path`'''
+        key_store.source = self.write_jwks(path)
+        key_store.clear()
+
+    def mint(self, permissions=(), sub='local|user', expires_in=3600,
+             **claims):
+        now = int(time.time())
+        payload = {
+            'iss': 'https://{}/'.format(AUTH0_DOMAIN),
+            'sub': sub,
+            'aud': API_AUDIENCE,
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions)
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self._private_pem,
+                          algorithm=ALGORITHMS[0], headers={'kid': self.kid})
+
+    def mint_role(self, role, **kwargs):
+        kwargs.setdefault('sub', 'local|{}'.format(role))
+        return self.mint(ROLE_PERMISSIONS[role], **kwargs)
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+VerifiedToken = namedtuple('VerifiedToken', ['payload', 'permissions',
+                                             'expires_at'])
+
+'''
+VerifiedTokenCache
+    a bounded LRU of tokens whose signature and claims have already been
+    verified, so a client that repeats its bearer token skips the RS256
+    check until the token's `exp`.
+
+    Entries are keyed by a SHA-256 digest of the token (the raw token is
+    never kept) and carry the permissions as a frozenset. Tokens without
+    an `exp` claim are not cached.
+'''
+
+
+class VerifiedTokenCache:
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        key = _token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, token, payload):
+        entry = VerifiedToken(payload, permission_set(payload),
+                              payload.get('exp'))
+        if self.maxsize <= 0 or not isinstance(entry.expires_at,
+                                               (int, float)):
+            return entry
+
+        key = _token_key(token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
+
+
+def permission_set(payload):
+    permissions = payload.get('permissions')
+    if permissions is None:
+        return None
+    return frozenset(permissions)
+
+
+def _token_key(token):
+    if isinstance(token, str):
+        token = token.encode('utf-8')
+    return hashlib.sha256(token).digest()
+
+
+def token_cache_from_env():
+    return VerifiedTokenCache(
+        maxsize=int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+    )
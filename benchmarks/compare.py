@@ -0,0 +1,86 @@
+'''
+Compare two benchmarks.load reports
+    prints the change of every endpoint's latency percentiles and
+    throughput, and exits with status 1 when an endpoint got slower (p95)
+    or slower to serve (rps) by more than --threshold percent, or started
+    returning errors.
+
+    python -m benchmarks.compare base.json head.json --threshold 15
+'''
+import argparse
+import json
+import sys
+
+FIELDS = ('p50_ms', 'p95_ms', 'p99_ms', 'rps')
+
+
+def change(base, head):
+    if not base or head is None:
+        return None
+    return (head - base) / base * 100
+
+
+def compare(base, head, threshold):
+    '''returns (rows, regressions) for the endpoints in both reports'''
+    rows = []
+    regressions = []
+    for name in sorted(set(base['endpoints']) & set(head['endpoints'])):
+        before = base['endpoints'][name]
+        after = head['endpoints'][name]
+        changes = {field: change(before.get(field), after.get(field))
+                   for field in FIELDS}
+        rows.append((name, before, after, changes))
+
+        if changes['p95_ms'] is not None and changes['p95_ms'] > threshold:
+            regressions.append('{}: p95 {:+.1f}%'.format(
+                name, changes['p95_ms']))
+        if changes['rps'] is not None and changes['rps'] < -threshold:
+            regressions.append('{}: rps {:+.1f}%'.format(
+                name, changes['rps']))
+        if after.get('errors', 0) > before.get('errors', 0):
+            regressions.append('{}: {} errors (was {})'.format(
+                name, after['errors'], before.get('errors', 0)))
+    return rows, regressions
+
+
+def format_rows(rows):
+    lines = ['{:34} {:>22} {:>22} {:>22} {:>22}'.format(
+        'endpoint', *FIELDS)]
+    for name, before, after, changes in rows:
+        cells = []
+        for field in FIELDS:
+            if changes[field] is None:
+                cells.append('{:>22}'.format('-'))
+            else:
+                cells.append('{:>22}'.format('{} -> {} ({:+.1f}%)'.format(
+                    before[field], after[field], changes[field])))
+        lines.append('{:34} {}'.format(name, ' '.join(cells)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='allowed change in percent')
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    rows, regressions = compare(base, head, args.threshold)
+    print('\n'.join(format_rows(rows)))
+    for name in sorted(set(base['endpoints']) ^ set(head['endpoints'])):
+        print('{}: only in one report'.format(name))
+
+    if regressions:
+        print('\nRegressions over {}%:'.format(args.threshold))
+        print('\n'.join('  ' + regression for regression in regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
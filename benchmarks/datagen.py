@@ -0,0 +1,75 @@
+import random
+
+
+'''
+Deterministic synthetic data
+    the same seed always produces the same shelters and animals, so runs
+    on different commits load identical data sets.
+'''
+
+# (city, state, latitude, longitude) of the city centre
+CITIES = [('Oakland', 'CA', 37.8044, -122.2712),
+          ('Sacramento', 'CA', 38.5816, -121.4944),
+          ('Portland', 'OR', 45.5152, -122.6784),
+          ('Seattle', 'WA', 47.6062, -122.3321),
+          ('Austin', 'TX', 30.2672, -97.7431),
+          ('Denver', 'CO', 39.7392, -104.9903),
+          ('Chicago', 'IL', 41.8781, -87.6298),
+          ('Boston', 'MA', 42.3601, -71.0589)]
+SPECIES_BREEDS = {
+    'dog': ['labrador', 'chihuahua', 'german shepherd', 'beagle', 'mixed'],
+    'cat': ['siamese', 'maine coon', 'tabby', 'persian', 'mixed'],
+    'bird': ['african grey', 'cockatiel', 'parakeet'],
+    'rabbit': ['lop', 'rex', 'dutch'],
+    'horse': ['clydesdale', 'arabian', 'mustang']
+}
+NAMES = ['Sadie', 'Zik', 'Zonk', 'Mary Lou', 'Dyno', 'Fab', 'Biscuit',
+         'Pepper', 'Luna', 'Milo', 'Rocket', 'Alabaster', 'Juniper', 'Otis']
+
+
+def generate_shelters(count, seed=0):
+    rng = random.Random('shelters:{}'.format(seed))
+    for n in range(count):
+        city, state, latitude, longitude = rng.choice(CITIES)
+        yield {
+            'name': '{} Animal Rescue {}'.format(city, n),
+            'city': city,
+            'state': state,
+            'address': '{} {} Street'.format(rng.randint(1, 9999),
+                                             rng.choice(NAMES)),
+            'phone': '{}-555-{:04d}'.format(rng.randint(200, 999),
+                                            rng.randint(0, 9999)),
+            # Spread over roughly 20 km around the centre
+            'latitude': round(latitude + rng.uniform(-0.1, 0.1), 6),
+            'longitude': round(longitude + rng.uniform(-0.1, 0.1), 6)
+        }
+
+
+def generate_animals(count, shelter_count, seed=0):
+    rng = random.Random('animals:{}'.format(seed))
+    species = sorted(SPECIES_BREEDS)
+    for n in range(count):
+        kind = rng.choice(species)
+        yield {
+            'name': '{} {}'.format(rng.choice(NAMES), n),
+            'gender': rng.choice(['female', 'male']),
+            'age': rng.randint(0, 20),
+            'species': kind,
+            'breed': rng.choice(SPECIES_BREEDS[kind]),
+            'shelter_id': rng.randint(1, shelter_count)
+        }
+
+
+def seed_database(shelters, animals, seed=0, batch_size=5000):
+    '''Insert the data set; run inside an app context on an empty schema'''
+    from models import Shelter, Animal
+
+    for model, rows in ((Shelter, generate_shelters(shelters, seed)),
+                        (Animal, generate_animals(animals, shelters, seed))):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                model.bulk_insert(batch)
+                batch = []
+        model.bulk_insert(batch)
@@ -0,0 +1,105 @@
+'''
+JSON encoding micro-benchmark
+    times the response encoders of serialization.py on /animals and
+    /shelters?include=animals payloads of the sizes the API serves: a
+    default page, a full page and a streamed collection.
+
+    python -m benchmarks.json_encoding --repeat 20
+
+    Each payload is encoded with flask.json (what jsonify used before),
+    the standard library encoder and, when installed, orjson, in compact
+    and in sorted mode. Reported are the median milliseconds per
+    encoding, the speed-up over flask.json and the body size.
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from benchmarks.datagen import generate_animals, generate_shelters
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def animal_payload(count, seed=0):
+    animals = [dict(id=n + 1, **animal) for n, animal in
+               enumerate(generate_animals(count, max(1, count // 100),
+                                          seed))]
+    return {'success': True, 'animals': animals, 'next_cursor': 'eyJpZCI6NTB9'}
+
+
+def shelter_payload(count, animals_each, seed=0):
+    animals = animal_payload(count * animals_each, seed)['animals']
+    shelters = []
+    for n, shelter in enumerate(generate_shelters(count, seed)):
+        shelter = dict(id=n + 1, **shelter)
+        shelter['animals'] = animals[n * animals_each:(n + 1) * animals_each]
+        shelters.append(shelter)
+    return {'success': True, 'shelters': shelters, 'next_cursor': None}
+
+
+def payloads():
+    return [
+        ('/animals (50)', animal_payload(50)),
+        ('/animals (200)', animal_payload(200)),
+        ('/animals?stream=true (20000)', animal_payload(20000)),
+        ('/shelters?include=animals (50x20)', shelter_payload(50, 20))
+    ]
+
+
+def encoders():
+    sys.path.insert(0, ROOT)
+    from flask import json as flask_json
+    from serialization import make_encoder, orjson
+
+    def flask_dumps(value):
+        # Flask's defaults: sorted keys, ASCII only
+        return flask_json.dumps(value).encode('utf-8')
+
+    found = [('flask.json', flask_dumps)]
+    kinds = ['stdlib'] + (['orjson'] if orjson is not None else [])
+    for kind in kinds:
+        for compact in (True, False):
+            found.append(('{} ({})'.format(kind, 'compact' if compact
+                                           else 'sorted'),
+                          make_encoder(kind, compact).dumps))
+    return found
+
+
+def measure(dumps, value, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = dumps(value)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = {}
+    for payload_name, value in payloads():
+        results[payload_name] = {}
+        baseline = None
+        for encoder_name, dumps in encoders():
+            ms, size = measure(dumps, value, args.repeat)
+            baseline = baseline or ms
+            results[payload_name][encoder_name] = {
+                'ms': round(ms, 3), 'speedup': round(baseline / ms, 2),
+                'bytes': size}
+            print('{:36} {:18} {:9.3f} ms {:6.2f}x {:10} bytes'.format(
+                payload_name, encoder_name, ms, baseline / ms, size))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
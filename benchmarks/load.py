@@ -0,0 +1,284 @@
+'''
+Endpoint load test
+    seeds a deterministic data set, serves the app through gunicorn and
+    drives every endpoint in turn at a fixed concurrency, reads first and
+    writes after. Bearer tokens are minted from a local key pair and
+    verified through a JWKS file, so the run needs no network access.
+
+    python -m benchmarks.load --shelters 200 --animals 20000 \
+        --concurrency 16 --duration 5 --output bench.json
+    python -m benchmarks.compare base.json bench.json
+
+    Without --database-url a SQLite file is seeded in a temporary
+    directory. A --database-url (a local PostgreSQL, say) has its tables
+    dropped and re-created before seeding.
+
+    The response cache is off unless --response-cache is given, so the
+    numbers follow the query paths rather than cache hits. Rate limiting
+    is off too, every request comes from the same client.
+'''
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+from urllib.parse import urlsplit
+
+from benchmarks.datagen import generate_animals, generate_shelters, \
+    seed_database
+from benchmarks.loadgen import gunicorn_server, run_load
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(database_url, shelters, animals, seed_value):
+    os.environ['DATABASE_URL'] = database_url
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    from models import db
+
+    with create_app().app_context():
+        db.drop_all()
+        db.create_all()
+        seed_database(shelters, animals, seed_value)
+        return db.engine.dialect.name
+
+
+def max_ids(database_url):
+    from app import create_app
+    from models import Shelter, Animal
+
+    with create_app().app_context():
+        return (Shelter.query.with_entities(Shelter.id)
+                .order_by(Shelter.id.desc()).limit(1).scalar(),
+                Animal.query.with_entities(Animal.id)
+                .order_by(Animal.id.desc()).limit(1).scalar())
+
+
+'''
+consume(paths)
+    a thread-safe request source that sends each request once and then
+    reports exhaustion, for requests such as DELETE that only succeed once
+'''
+
+
+def consume(requests):
+    iterator = iter(requests)
+    lock = threading.Lock()
+
+    def next_request():
+        with lock:
+            return next(iterator, None)
+
+    return next_request
+
+
+def fetch_etag(base_url, path):
+    target = urlsplit(base_url)
+    connection = http.client.HTTPConnection(target.hostname, target.port,
+                                            timeout=30)
+    connection.request('GET', path)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.getheader('ETag')
+
+
+def read_scenarios(args, base_url):
+    from pagination import encode_cursor
+
+    shelter_ids = range(1, args.shelters + 1)
+    etag = fetch_etag(base_url, '/animals')
+    return [
+        ('GET /', [('GET', '/', None, None)]),
+        ('GET /shelters', [('GET', '/shelters', None, None)]),
+        ('GET /shelters?include=animals',
+         [('GET', '/shelters?include=animals&limit=20', None, None)]),
+        ('GET /shelters?include_total=true',
+         [('GET', '/shelters?include_total=true', None, None)]),
+        ('GET /animals', [('GET', '/animals', None, None)]),
+        ('GET /animals (deep cursor)',
+         [('GET', '/animals?cursor=' + encode_cursor(args.animals // 2),
+           None, None)]),
+        ('GET /animals (filtered)',
+         [('GET', '/animals?species=cat&min_age=2&max_age=8', None, None),
+          ('GET', '/animals?species=dog&breed=beagle', None, None),
+          ('GET', '/animals?gender=female&shelter_id=1', None, None)]),
+        ('GET /animals (If-None-Match)',
+         [('GET', '/animals', {'If-None-Match': etag}, None)]),
+        ('GET /animals?stream=true',
+         [('GET', '/animals?stream=true', None, None)]),
+        ('GET /animals (gzip)',
+         [('GET', '/animals?limit=200', {'Accept-Encoding': 'gzip'}, None)]),
+        ('GET /animals?stream=true (gzip)',
+         [('GET', '/animals?stream=true', {'Accept-Encoding': 'gzip'},
+           None)]),
+        ('GET /animals?fields=id,name,species',
+         [('GET', '/animals?fields=id,name,species', None, None)]),
+        ('GET /animals?stream=true&fields=id,name,species',
+         [('GET', '/animals?stream=true&fields=id,name,species', None,
+           None)]),
+        ('GET /shelters/nearby',
+         [('GET', '/shelters/nearby?lat=37.8&lon=-122.27&radius=25',
+           None, None),
+          ('GET', '/shelters/nearby?lat=41.88&lon=-87.63&radius=10&'
+           'include=animal_counts', None, None)]),
+        ('GET /search',
+         [('GET', '/search?q=lab', None, None),
+          ('GET', '/search?q=oakland%20rescue', None, None),
+          ('GET', '/search?q=sadie&type=animals', None, None)]),
+        ('GET /stats', [('GET', '/stats', None, None)]),
+        ('GET /stats?group_by=shelter_id,species',
+         [('GET', '/stats?group_by=shelter_id,species', None, None)]),
+        ('GET /shelters/<id>/animals',
+         [('GET', '/shelters/{}/animals'.format(shelter_id), None, None)
+          for shelter_id in shelter_ids]),
+        ('GET /metrics', [('GET', '/metrics', None, None)])
+    ]
+
+
+def write_scenarios(args, headers):
+    shelter = next(generate_shelters(1, args.seed))
+    animal = next(generate_animals(1, args.shelters, args.seed))
+
+    def body(value):
+        return json.dumps(value)
+
+    shelter_ids = range(1, args.shelters + 1)
+    animal_ids = range(1, args.animals + 1, max(1, args.animals // 1000))
+    return [
+        ('POST /shelters', [('POST', '/shelters', headers, body(shelter))]),
+        ('POST /animals', [('POST', '/animals', headers, body(animal))]),
+        ('POST /shelters/bulk',
+         [('POST', '/shelters/bulk', headers,
+           body(list(generate_shelters(100, args.seed))))]),
+        ('POST /animals/bulk',
+         [('POST', '/animals/bulk', headers,
+           body(list(generate_animals(100, args.shelters, args.seed))))]),
+        ('PATCH /shelters/<id>',
+         [('PATCH', '/shelters/{}'.format(shelter_id), headers,
+           body({'phone': '555-0100'})) for shelter_id in shelter_ids]),
+        ('PATCH /animals/<id>',
+         [('PATCH', '/animals/{}'.format(animal_id), headers,
+           body({'age': 3})) for animal_id in animal_ids]),
+        ('POST /animals/transfer',
+         [('POST', '/animals/transfer', headers,
+           body({'animal_ids': list(range(first, first + 20)),
+                 'shelter_id': shelter_id}))
+          for first, shelter_id in zip(animal_ids, shelter_ids)])
+    ]
+
+
+def delete_scenarios(args, headers):
+    # Only rows created by the write scenarios are deleted, which leaves
+    # the seeded data set intact; the new shelters have no animals
+    last_shelter, last_animal = max_ids(args.database_url)
+    return [
+        ('DELETE /animals/<id>',
+         consume(('DELETE', '/animals/{}'.format(animal_id), headers, None)
+                 for animal_id in range(last_animal, args.animals, -1))),
+        ('DELETE /shelters/<id>',
+         consume(('DELETE', '/shelters/{}'.format(shelter_id), headers, None)
+                 for shelter_id in range(last_shelter, args.shelters, -1)))
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database-url')
+    parser.add_argument('--shelters', type=int, default=100)
+    parser.add_argument('--animals', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds per endpoint')
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--response-cache', default='none',
+                        help='RESPONSE_CACHE_BACKEND for the server')
+    parser.add_argument('--rate-limit', default='none',
+                        help='RATE_LIMIT_STORE for the server')
+    parser.add_argument('--port', type=int, default=8098)
+    parser.add_argument('--only', help='comma separated substrings of the '
+                                       'endpoint names to run')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='animalrescue-bench-')
+    if not args.database_url:
+        args.database_url = 'sqlite:///' + os.path.join(workdir,
+                                                        'bench.sqlite')
+    dialect = seed(args.database_url, args.shelters, args.animals, args.seed)
+
+    from auth.local_signer import LocalSigner
+    signer = LocalSigner()
+    jwks_path = signer.write_jwks(os.path.join(workdir, 'jwks.json'))
+    headers = {
+        'Authorization': 'Bearer ' + signer.mint_role('domain_admin'),
+        'Content-Type': 'application/json'
+    }
+
+    env = dict(os.environ, DATABASE_URL=args.database_url,
+               JWKS_URL=jwks_path, GUNICORN_WORKER_CLASS=args.worker_class,
+               WEB_CONCURRENCY=str(args.workers),
+               GUNICORN_THREADS=str(args.threads),
+               RESPONSE_CACHE_BACKEND=args.response_cache,
+               RATE_LIMIT_STORE=args.rate_limit)
+    base_url = 'http://127.0.0.1:{}'.format(args.port)
+    selected = args.only.split(',') if args.only else None
+    results = {}
+
+    def run(scenarios):
+        for name, requests in scenarios:
+            if selected and not any(part in name for part in selected):
+                continue
+            results[name] = run_load(base_url, requests, args.concurrency,
+                                     args.duration)
+            print('{:34} {}'.format(name, json.dumps(results[name])))
+
+    with gunicorn_server(env, args.port, ROOT):
+        run_load(base_url, [('GET', '/animals', None, None)],
+                 args.concurrency, 1.0)  # warm up
+        run(read_scenarios(args, base_url))
+        run(write_scenarios(args, headers))
+        run(delete_scenarios(args, headers))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'database': dialect,
+            'seed': args.seed,
+            'shelters': args.shelters,
+            'animals': args.animals,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'worker_class': args.worker_class,
+            'workers': args.workers,
+            'threads': args.threads,
+            'response_cache': args.response_cache,
+            'rate_limit': args.rate_limit
+        },
+        'endpoints': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
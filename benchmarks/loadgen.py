@@ -0,0 +1,136 @@
+import http.client
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+'''
+Closed-loop HTTP load generator
+    `concurrency` client threads each keep one keep-alive connection and
+    send requests back to back until `duration` seconds have passed.
+'''
+
+
+def run_load(base_url, requests, concurrency=8, duration=10.0):
+    '''
+    requests: list of (method, path, headers, body) tuples, sent round
+    robin by every client, or a thread-safe callable returning the next
+    tuple; a client stops early once the callable returns None
+    returns a summary dict, see summarize()
+    '''
+    target = urlsplit(base_url)
+    deadline = time.monotonic() + duration
+    latencies = []
+    errors = [0]
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def client(offset):
+        connection = http.client.HTTPConnection(target.hostname, target.port,
+                                                timeout=30)
+        local = []
+        local_errors = 0
+        local_statuses = Counter()
+        i = offset
+        while time.monotonic() < deadline:
+            if callable(requests):
+                next_request = requests()
+                if next_request is None:
+                    break
+            else:
+                next_request = requests[i % len(requests)]
+                i += 1
+            method, path, headers, body = next_request
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body=body,
+                                   headers=headers or {})
+                response = connection.getresponse()
+                response.read()
+                local_statuses[response.status] += 1
+                if response.status >= 500:
+                    local_errors += 1
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                connection.close()
+                continue
+            local.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+            statuses.update(local_statuses)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(n,))
+               for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return summarize(latencies, errors[0], time.monotonic() - started,
+                     statuses)
+
+
+def summarize(latencies, errors, elapsed, statuses=None):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(p / 100 * len(latencies))))
+        return round(latencies[index] * 1000, 3)
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'statuses': {str(status): count
+                     for status, count in sorted((statuses or {}).items())}
+    }
+
+
+def wait_until_up(base_url, timeout=30.0):
+    target = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(target.hostname,
+                                                    target.port, timeout=2)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('{} did not come up'.format(base_url))
+
+
+@contextmanager
+def gunicorn_server(env, port, cwd):
+    '''
+    runs `gunicorn -c gunicorn.conf.py app:APP` from `cwd` with `env` and
+    yields the process once it answers; gunicorn 20 has no __main__, so
+    it is started through its entry point
+    '''
+    server = subprocess.Popen(
+        [sys.executable, '-c',
+         'from gunicorn.app.wsgiapp import run; run()',
+         '-c', 'gunicorn.conf.py', 'app:APP'],
+        cwd=cwd, env=dict(env, PORT=str(port)), stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    base_url = 'http://127.0.0.1:{}'.format(port)
+    try:
+        wait_until_up(base_url)
+        yield server
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
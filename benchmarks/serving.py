@@ -0,0 +1,111 @@
+'''
+Serving-mode benchmark
+    starts gunicorn once per worker class with the same number of worker
+    processes (the memory budget), drives the read endpoints at a fixed
+    concurrency and reports throughput, latency and the workers' RSS.
+
+    python -m benchmarks.serving --modes sync,gthread,gevent \
+        --workers 2 --concurrency 32 --duration 10
+
+    Without --database-url a SQLite file is seeded in a temporary
+    directory. SQLite answers in microseconds, so run against PostgreSQL
+    (ideally on another host) to see how the modes cope with network
+    waits, which is what they differ on.
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.datagen import seed_database
+from benchmarks.loadgen import gunicorn_server, run_load
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READ_REQUESTS = [
+    ('GET', '/shelters', None, None),
+    ('GET', '/animals', None, None),
+    ('GET', '/animals?species=cat&max_age=5', None, None),
+    ('GET', '/shelters/1/animals', None, None)
+]
+
+
+def seed_sqlite(path, shelters, animals, seed=0):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    from models import db
+
+    with create_app().app_context():
+        db.create_all()
+        seed_database(shelters, animals, seed)
+
+
+def worker_rss_kb(master_pid):
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/status'.format(pid)) as f:
+                status = dict(line.split(':', 1) for line in f
+                              if ':' in line)
+        except OSError:
+            continue
+        if int(status['PPid']) == master_pid:
+            total += int(status.get('VmRSS', '0 kB').split()[0])
+    return total
+
+
+def run_mode(mode, args, env):
+    env = dict(env, GUNICORN_WORKER_CLASS=mode,
+               WEB_CONCURRENCY=str(args.workers),
+               GUNICORN_THREADS=str(args.threads),
+               RESPONSE_CACHE_BACKEND='none', RATE_LIMIT_STORE='none',
+               # The modes are compared on how they queue, not shed
+               LOAD_SHED_MAX_IN_FLIGHT='0')
+    base_url = 'http://127.0.0.1:{}'.format(args.port)
+    with gunicorn_server(env, args.port, ROOT) as server:
+        run_load(base_url, READ_REQUESTS, args.concurrency, 1.0)  # warm up
+        result = run_load(base_url, READ_REQUESTS, args.concurrency,
+                          args.duration)
+        result['worker_rss_kb'] = worker_rss_kb(server.pid) \
+            if os.path.isdir('/proc') else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--modes', default='sync,gthread,gevent')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--database-url')
+    parser.add_argument('--shelters', type=int, default=50)
+    parser.add_argument('--animals', type=int, default=5000)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.database_url:
+        env['DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+        seed_sqlite(path, args.shelters, args.animals)
+        env['DATABASE_URL'] = 'sqlite:///' + path
+
+    results = {}
+    for mode in args.modes.split(','):
+        results[mode] = run_mode(mode, args, env)
+        print('{:8} {}'.format(mode, json.dumps(results[mode])))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
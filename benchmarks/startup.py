@@ -0,0 +1,88 @@
+'''
+Cold start benchmark
+    times what a fresh worker pays before it serves its first request:
+    importing app, then building the application gunicorn serves.
+
+    python -m benchmarks.startup --repeat 10
+
+    Each stage runs in a new interpreter under `python -X importtime`, so
+    nothing is cached between runs but the operating system's file cache.
+    Reported are the median wall milliseconds of each stage and the
+    modules with the largest cumulative import time in the last run.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = [
+    ('import app', 'import app'),
+    ('import app; app.APP', 'import app; app.APP'),
+    ('import models', 'import models')
+]
+
+
+def run(code, env):
+    '''(wall seconds, {module: cumulative microseconds}) of one run'''
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, parse_importtime(process.stderr)
+
+
+def parse_importtime(text):
+    '''{module: cumulative microseconds} from -X importtime output'''
+    modules = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        modules[fields[2].strip()] = int(fields[1])
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15,
+                        help='modules to list per stage')
+    parser.add_argument('--database-url',
+                        default='sqlite:////tmp/animalrescue-startup.sqlite')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=args.database_url)
+    env.pop('REPLICA_DATABASE_URL', None)
+
+    results = {}
+    for name, code in STAGES:
+        timings = []
+        for _ in range(args.repeat):
+            elapsed, modules = run(code, env)
+            timings.append(elapsed)
+        top = sorted(modules.items(), key=lambda item: -item[1])[:args.top]
+        results[name] = {
+            'ms': round(statistics.median(timings) * 1000, 1),
+            'modules': [{'module': module, 'ms': round(us / 1000, 1)}
+                        for module, us in top]}
+        print('{:24} {:9.1f} ms'.format(name, results[name]['ms']))
+        for module, us in top:
+            print('    {:40} {:9.1f} ms'.format(module, us / 1000))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
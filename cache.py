@@ -0,0 +1,356 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, has_app_context, make_response, request
+
+from replicas import read_your_writes
+from compression import get_compression
+
+
+logger = logging.getLogger(__name__)
+
+'''
+Response cache
+    caches the serialized body of the public read endpoints.
+
+    Every key embeds a generation number kept in the backend. A write to
+    shelters or animals (see models.on_catalog_change) bumps the
+    generation, which orphans every cached entry at once; the orphans age
+    out through the TTL and the size bound. With a shared backend (file or
+    redis) one worker's write invalidates the cache of every worker; with
+    the in-process backend other workers may serve a stale entry for up
+    to the TTL.
+
+Backends implement:
+    get(key) -> bytes or None
+    set(key, value, ttl)
+    generation() -> int
+    bump_generation()
+'''
+
+
+class MemoryBackend:
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generation(self):
+        return self._generation
+
+    def bump_generation(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+'''
+FileBackend
+    one file per entry in a directory shared by every worker on the host
+    (point it at /dev/shm for a shared-memory store). Writes go through a
+    temporary file and os.replace so readers never see a partial entry.
+    The least recently used files are removed once there are more than
+    `max_entries`.
+'''
+
+
+class FileBackend:
+
+    GENERATION_FILE = 'generation'
+
+    def __init__(self, directory, max_entries=512):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires_at = float(f.readline())
+                if expires_at <= time.time():
+                    return None
+                value = f.read()
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value, ttl):
+        expires_at = '{}\n'.format(time.time() + ttl).encode('ascii')
+        self._write(self._path(key), expires_at + value)
+        self._evict()
+
+    def generation(self):
+        try:
+            with open(os.path.join(self.directory,
+                                   self.GENERATION_FILE)) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump_generation(self):
+        # A unique value rather than a read-modify-write counter: two
+        # workers bumping at once must not end up on the same generation
+        generation = time.time_ns()
+        self._write(os.path.join(self.directory, self.GENERATION_FILE),
+                    str(generation).encode('ascii'))
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith('.') or \
+                        entry.name == self.GENERATION_FILE:
+                    continue
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+'''
+RedisBackend
+    works with any client exposing redis-py's get/set(ex=)/incr, so a
+    local stand-in can replace the server in tests. The size bound is the
+    server's job (maxmemory with an allkeys-lru policy).
+'''
+
+
+class RedisBackend:
+
+    def __init__(self, client, prefix='animalrescue:cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    def generation(self):
+        return int(self.client.get(self.prefix + 'generation') or 0)
+
+    def bump_generation(self):
+        self.client.incr(self.prefix + 'generation')
+
+
+class ResponseCache:
+
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key_for(self, req, encoding=None):
+        try:
+            generation = self.backend.generation()
+        except Exception as e:
+            logger.warning('Response cache unavailable: %s', e)
+            return None
+        args = '&'.join(sorted('{}={}'.format(key, value)
+                               for key, value in req.args.items(multi=True)))
+        key = '{}:{}?{}'.format(generation, req.path, args)
+        if encoding:
+            # Each content coding of the same response is its own entry
+            key += '|' + encoding
+        return key
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning('Response cache read failed: %s', e)
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _load_response(value)
+
+    def set(self, key, response):
+        try:
+            self.backend.set(key, _dump_response(response), self.ttl)
+        except Exception as e:
+            logger.warning('Response cache write failed: %s', e)
+
+    def invalidate(self):
+        self.invalidations += 1
+        try:
+            self.backend.bump_generation()
+        except Exception as e:
+            logger.warning('Response cache invalidation failed: %s', e)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
+
+
+# Headers worth replaying on a hit; CORS and the like are added per request
+CACHED_HEADERS = ('Content-Type', 'Content-Encoding', 'ETag',
+                  'Last-Modified', 'Cache-Control')
+
+
+def _dump_response(response):
+    head = {
+        'status': response.status_code,
+        'headers': [(name, value) for name, value in response.headers
+                    if name in CACHED_HEADERS]
+    }
+    return json.dumps(head).encode('utf-8') + b'\n' + response.get_data()
+
+
+def _load_response(value):
+    head, body = value.split(b'\n', 1)
+    head = json.loads(head)
+    return current_app.response_class(body, status=head['status'],
+                                      headers=head['headers'])
+
+
+'''
+setup_response_cache(app)
+    configures the cache from RESPONSE_CACHE_* settings (app config first,
+    then the environment) and stores it in app.extensions
+        RESPONSE_CACHE_BACKEND: memory (default), file, redis or none
+        RESPONSE_CACHE_TTL: seconds an entry lives (default 30)
+        RESPONSE_CACHE_MAX_ENTRIES: size bound of memory/file (default 512)
+        RESPONSE_CACHE_DIR: directory of the file backend
+        RESPONSE_CACHE_URL: redis:// URL of the redis backend
+'''
+
+
+def setup_response_cache(app, backend=None):
+    def setting(name, default=None):
+        return app.config.get(name, os.environ.get(name, default))
+
+    if backend is None:
+        kind = setting('RESPONSE_CACHE_BACKEND', 'memory')
+        max_entries = int(setting('RESPONSE_CACHE_MAX_ENTRIES', 512))
+        if kind == 'none':
+            app.extensions['response_cache'] = None
+            return None
+        elif kind == 'memory':
+            backend = MemoryBackend(max_entries)
+        elif kind == 'file':
+            backend = FileBackend(
+                setting('RESPONSE_CACHE_DIR',
+                        os.path.join(tempfile.gettempdir(),
+                                     'animalrescue-cache')),
+                max_entries)
+        elif kind == 'redis':
+            backend = RedisBackend.from_url(setting('RESPONSE_CACHE_URL'))
+        else:
+            raise ValueError('Unknown RESPONSE_CACHE_BACKEND: ' + kind)
+
+    cache = ResponseCache(backend,
+                          ttl=float(setting('RESPONSE_CACHE_TTL', 30)))
+    app.extensions['response_cache'] = cache
+    return cache
+
+
+def invalidate_response_cache():
+    if not has_app_context():
+        return
+    cache = current_app.extensions.get('response_cache')
+    if cache is not None:
+        cache.invalidate()
+
+
+'''
+@cached_response
+    serves a GET view from the response cache; only complete 200
+    responses are stored. A hit still honours If-None-Match. Requests
+    asking to read their own writes skip the cache. Responses are stored
+    compressed in the encoding negotiated with the client, see
+    compression.py.
+'''
+
+
+def cached_response(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions.get('response_cache')
+        if cache is None or request.method != 'GET' or \
+                read_your_writes(request):
+            return f(*args, **kwargs)
+
+        compression = get_compression()
+        encoding = compression.negotiate(request) if compression else None
+        key = cache.key_for(request, encoding)
+        if key is None:
+            return f(*args, **kwargs)
+
+        response = cache.get(key)
+        if response is not None:
+            return response.make_conditional(request)
+
+        response = make_response(f(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            if compression is not None:
+                compression.compress(response, encoding)
+            cache.set(key, response)
+        return response
+
+    return wrapper
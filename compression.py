@@ -0,0 +1,148 @@
+import os
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+'''
+Response compression
+    JSON and text responses are compressed with brotli (when the brotli
+    package is installed) or gzip, whichever the client prefers in
+    Accept-Encoding; on a tie brotli wins, it makes smaller bodies.
+    Buffered bodies under the minimum size go out as they are, the
+    framing costs more than it saves. Streamed bodies are compressed
+    chunk by chunk, each chunk flushed so the client can start parsing.
+
+    The response cache stores the compressed bytes under the negotiated
+    encoding (see cache.cached_response), so a hit is not compressed
+    again. The ETags are weak, which stays valid across encodings.
+
+    Configured from the app config first, then the environment:
+        COMPRESS_ENCODINGS: encodings to offer, in order of preference
+            (default br,gzip); none turns compression off
+        COMPRESS_MIN_SIZE: smallest buffered body to compress, in bytes
+            (default 1024)
+        COMPRESS_GZIP_LEVEL: 1 (fastest) to 9 (smallest), default 6
+        COMPRESS_BROTLI_QUALITY: 0 (fastest) to 11 (smallest), default 4
+'''
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html')
+
+
+class Compression:
+
+    def __init__(self, encodings=('br', 'gzip'), min_size=1024,
+                 gzip_level=6, brotli_quality=4):
+        for encoding in encodings:
+            if encoding not in ('br', 'gzip'):
+                raise ValueError('Unknown COMPRESS_ENCODINGS entry: ' +
+                                 encoding)
+        # Offering brotli needs the package; gzip is always available
+        self.encodings = [encoding for encoding in encodings
+                          if encoding != 'br' or brotli is not None]
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def negotiate(self, req):
+        '''the encoding to send `req`, or None for an uncompressed body'''
+        if not self.encodings or 'Accept-Encoding' not in req.headers:
+            return None
+        return req.accept_encodings.best_match(self.encodings)
+
+    def compress(self, response, encoding):
+        '''compress `response` in place; returns whether it did'''
+        if encoding is None or not self.applies_to(response):
+            return False
+        if response.is_streamed:
+            response.response = self._compress_stream(
+                response.iter_encoded(), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return False
+            response.set_data(self._compressor(encoding)(data))
+        response.headers['Content-Encoding'] = encoding
+        return True
+
+    def applies_to(self, response):
+        return (response.status_code == 200 and
+                'Content-Encoding' not in response.headers and
+                response.mimetype in COMPRESSIBLE_MIMETYPES)
+
+    def _compressor(self, encoding):
+        if encoding == 'br':
+            return lambda data: brotli.compress(
+                data, mode=brotli.MODE_TEXT, quality=self.brotli_quality)
+        # wbits 31: a deflate stream with a gzip header and trailer
+        return lambda data: zlib.compress(data, self.gzip_level, 31)
+
+    def _compress_stream(self, chunks, encoding):
+        if encoding == 'br':
+            compressor = brotli.Compressor(mode=brotli.MODE_TEXT,
+                                           quality=self.brotli_quality)
+
+            def process(chunk):
+                return compressor.process(chunk) + compressor.flush()
+            finish = compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+
+            def process(chunk):
+                return compressor.compress(chunk) + \
+                    compressor.flush(zlib.Z_SYNC_FLUSH)
+
+            def finish():
+                return compressor.flush(zlib.Z_FINISH)
+
+        for chunk in chunks:
+            if chunk:
+                yield process(chunk)
+        yield finish()
+
+
+def get_compression():
+    return current_app.extensions.get('compression')
+
+
+'''
+setup_compression(app)
+    configures compression from the COMPRESS_* settings and compresses
+    every eligible response after the view has run
+'''
+
+
+def setup_compression(app):
+    def setting(name, default=None):
+        return app.config.get(name, os.environ.get(name, default))
+
+    encodings = setting('COMPRESS_ENCODINGS', 'br,gzip')
+    if encodings == 'none':
+        app.extensions['compression'] = None
+    else:
+        app.extensions['compression'] = Compression(
+            [encoding.strip() for encoding in encodings.split(',')
+             if encoding.strip()],
+            min_size=int(setting('COMPRESS_MIN_SIZE', 1024)),
+            gzip_level=int(setting('COMPRESS_GZIP_LEVEL', 6)),
+            brotli_quality=int(setting('COMPRESS_BROTLI_QUALITY', 4)))
+
+    @app.after_request
+    def compress_response(response):
+        compression = get_compression()
+        if compression is None:
+            return response
+        if response.status_code == 304 or (
+                response.status_code == 200 and
+                response.mimetype in COMPRESSIBLE_MIMETYPES):
+            response.vary.add('Accept-Encoding')
+        compression.compress(response, compression.negotiate(request))
+        return response
+
+    return app.extensions['compression']
@@ -0,0 +1,59 @@
+import hashlib
+from flask import current_app, request
+from sqlalchemy import func, select
+from models import db, TableVersion
+
+
+'''
+Conditional GET
+    a table is fingerprinted by (max(updated_at), write version): the
+    newest row from the updated_at index and the table's counter in
+    table_versions, bumped by every write to it (see models.py). Neither
+    reads the table's rows, whatever the size of the table or the filters
+    of the request. The fingerprint of every table a response depends
+    on, plus the request path and query string, makes a weak ETag. When
+    the client already holds that ETag (If-None-Match) the endpoint
+    answers 304 before running the real query.
+
+    There is no Last-Modified: deleting a row leaves max(updated_at) as
+    it was, so If-Modified-Since would answer 304 for a collection that
+    lost rows. The write version in the ETag sees the delete.
+'''
+
+
+def table_versions(*models):
+    '''[(max(updated_at), write version)] of each model's table, in one
+    SELECT'''
+    columns = []
+    for model in models:
+        columns.append(select([func.max(model.updated_at)]).as_scalar())
+        columns.append(select([TableVersion.version]).where(
+            TableVersion.table_name == model.__tablename__).as_scalar())
+    row = db.session.execute(select(columns)).first()
+    return [tuple(row[index:index + 2]) for index in range(0, len(row), 2)]
+
+
+class Validators:
+
+    def __init__(self, *versions):
+        fingerprint = [request.path] + sorted(
+            '{}={}'.format(key, value)
+            for key, value in request.args.items(multi=True))
+        for updated_at, version in versions:
+            fingerprint.append('{}|{}'.format(
+                updated_at.isoformat() if updated_at else '', version or 0))
+        self.etag = hashlib.sha1(
+            '\n'.join(fingerprint).encode('utf-8')).hexdigest()
+
+    def is_fresh(self):
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        return False
+
+    def apply(self, response):
+        response.set_etag(self.etag, weak=True)
+        response.cache_control.no_cache = True
+        return response
+
+    def not_modified(self):
+        return self.apply(current_app.response_class(status=304))
@@ -0,0 +1,221 @@
+import os
+
+import pytest
+from sqlalchemy import event, orm
+
+import auth.auth
+from app import create_app
+from auth.local_signer import ROLE_PERMISSIONS, LocalSigner
+from models import db, Shelter, Animal
+
+
+'''
+Test fixtures
+    The schema is created once per session, in an in-memory SQLite
+    database or, when TEST_DATABASE_URL is set, in a PostgreSQL schema of
+    its own, and seeded with CATALOG. Every test then runs inside a
+    transaction that is rolled back when it ends: the app's commits only
+    release SAVEPOINTs within it. Tests see the catalog and nothing the
+    others wrote, so they pass in any order and in parallel:
+
+        pytest -n auto
+
+    With pytest-xdist every worker process has its own database (SQLite)
+    or schema (PostgreSQL), named after the worker.
+
+    Tokens are signed with a local key pair whose JWKS is read from a
+    file (see auth/local_signer.py), so the tests never reach Auth0.
+'''
+
+TEST_CONFIG = {
+    'TESTING': True,
+    # Every request comes from the same client
+    'RATE_LIMIT_STORE': 'none',
+    'LOAD_SHED_MAX_IN_FLIGHT': 0
+}
+
+CATALOG = {
+    'shelters': [
+        dict(name='Humane Society of Vallejo', city='Vallejo',
+             state='California', address='1121 Sonoma Boulevard',
+             phone='707-555-0101', latitude=38.1041, longitude=-122.2566),
+        dict(name='East Bay Rescue', city='Oakland', state='California',
+             address='8323 Baldwin Street', phone='510-555-0102',
+             latitude=37.8044, longitude=-122.2712),
+        dict(name='Sacramento Animal Rescue', city='Sacramento',
+             state='California', address='2127 Front Street',
+             phone='916-555-0103', latitude=38.5816, longitude=-121.4944),
+        dict(name='Fresno Pet Rescue', city='Fresno', state='California',
+             address='5277 East Airways Boulevard', phone=None,
+             latitude=36.7378, longitude=-119.7871)
+    ],
+    # shelter is an index into the shelters above
+    'animals': [
+        dict(name='Biscuit', gender='male', age=3, species='dog',
+             breed='beagle', shelter=0),
+        dict(name='Mittens', gender='female', age=2, species='cat',
+             breed='tabby', shelter=0),
+        dict(name='Shadow', gender='male', age=7, species='cat',
+             breed='bombay', shelter=0),
+        dict(name='Rosie', gender='female', age=5, species='dog',
+             breed='labrador', shelter=1),
+        dict(name='Pepper', gender='female', age=1, species='cat',
+             breed='siamese', shelter=1),
+        dict(name='Duke', gender='male', age=11, species='dog',
+             breed='german shepherd', shelter=2),
+        dict(name='Clover', gender='female', age=4, species='rabbit',
+             breed='holland lop', shelter=2),
+        dict(name='Whiskers', gender='male', age=9, species='cat',
+             breed='maine coon', shelter=3)
+    ]
+}
+
+
+def worker_name():
+    '''the pytest-xdist worker running the session, "main" without it'''
+    return os.environ.get('PYTEST_XDIST_WORKER', 'main')
+
+
+def _use_savepoints_on_sqlite(engine):
+    # pysqlite begins and commits transactions on its own and gets
+    # SAVEPOINT wrong; leave it to SQLAlchemy
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.execute('BEGIN')
+
+
+def _use_schema(engine, schema):
+    @event.listens_for(engine, 'connect')
+    def set_search_path(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET search_path TO ' + schema)
+        cursor.close()
+
+    with engine.connect() as connection:
+        connection.execute('DROP SCHEMA IF EXISTS {0} CASCADE; '
+                           'CREATE SCHEMA {0}'.format(schema))
+
+
+@pytest.fixture(scope='session')
+def app():
+    database_url = os.environ.get('TEST_DATABASE_URL')
+    # An in-memory database lives as long as its connection, Flask-
+    # SQLAlchemy keeps one open for the app (StaticPool)
+    app = create_app(dict(TEST_CONFIG, DATABASE_URL=database_url or
+                          'sqlite://', REPLICA_DATABASE_URL=None))
+    schema = 'test_' + worker_name()
+
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            _use_savepoints_on_sqlite(engine)
+        else:
+            _use_schema(engine, schema)
+        db.create_all()
+
+    yield app
+
+    with app.app_context():
+        if engine.dialect.name == 'sqlite':
+            db.drop_all()
+        else:
+            with engine.connect() as connection:
+                connection.execute('DROP SCHEMA {} CASCADE'.format(schema))
+    engine.dispose()
+
+
+'''
+catalog
+    commits CATALOG once per session; the ids of the rows, by name:
+        {'shelters': {name: id}, 'animals': {name: id}}
+'''
+
+
+@pytest.fixture(scope='session')
+def catalog(app):
+    with app.app_context():
+        shelters = [Shelter(**row) for row in CATALOG['shelters']]
+        db.session.add_all(shelters)
+        db.session.flush()
+        animals = []
+        for row in CATALOG['animals']:
+            row = dict(row)
+            row['shelter_id'] = shelters[row.pop('shelter')].id
+            animals.append(Animal(**row))
+        db.session.add_all(animals)
+        db.session.commit()
+
+        return {'shelters': {shelter.name: shelter.id
+                             for shelter in shelters},
+                'animals': {animal.name: animal.id for animal in animals}}
+
+
+'''
+db_session
+    the app's session for one test, in a transaction rolled back at the
+    end of it, under an app context of its own that the test's requests
+    share. The session works in a SAVEPOINT, and starts a new one after
+    every commit or rollback of the last.
+'''
+
+
+@pytest.fixture
+def db_session(app, catalog):
+    with app.app_context():
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        factory = db.create_session({'bind': connection, 'binds': {}})
+        state = {'closing': False}
+
+        def make_session():
+            session = factory()
+            session.begin_nested()
+
+            @event.listens_for(session, 'after_transaction_end')
+            def restart_savepoint(session, ended):
+                if ended.nested and not ended._parent.nested and \
+                        not state['closing']:
+                    session.expire_all()
+                    session.begin_nested()
+
+            return session
+
+        app_session = db.session
+        db.session = orm.scoped_session(
+            make_session, scopefunc=app_session.registry.scopefunc)
+        try:
+            yield db.session
+        finally:
+            # Back out of the SAVEPOINT first, closing the session leaves
+            # it open on the connection
+            state['closing'] = True
+            db.session.rollback()
+            db.session.remove()
+            db.session = app_session
+            transaction.rollback()
+            connection.close()
+            # Responses cached during the test saw rows that are now gone
+            cache = app.extensions.get('response_cache')
+            if cache is not None:
+                cache.invalidate()
+
+
+@pytest.fixture(scope='session')
+def signer(tmp_path_factory):
+    signer = LocalSigner()
+    source = auth.auth.jwks.source
+    signer.install(auth.auth.jwks,
+                   str(tmp_path_factory.mktemp('jwks') / 'jwks.json'))
+    yield signer
+    auth.auth.jwks.source = source
+    auth.auth.jwks.clear()
+
+
+@pytest.fixture(scope='session')
+def tokens(signer):
+    '''{role: token} for every role of auth/local_signer.py'''
+    return {role: signer.mint_role(role) for role in ROLE_PERMISSIONS}
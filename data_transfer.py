@@ -0,0 +1,400 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import (db, apply_stats_deltas, mark_catalog_changed,
+                    geohash_for, stats_deltas, with_geohash, Shelter,
+                    Animal)
+from validation import (ANIMAL_FIELDS, SHELTER_FIELDS, validate_animal,
+                        validate_shelter)
+
+
+'''
+Bulk import and export for manage.py
+    files are read and written one batch at a time, so memory stays
+    bounded whatever the file size. Imports use COPY on PostgreSQL and
+    batched executemany elsewhere; exports read through a server-side
+    cursor. Both report progress and rows per second on stderr.
+
+    Supported formats: csv (with a header row) and ndjson (one JSON object
+    per line), picked from the file extension unless given explicitly.
+    An optional `id` column is imported as-is, which keeps the references
+    between shelters and animals intact when migrating a network.
+
+    Every batch is committed on its own. Rows that fail validation, carry
+    a malformed or taken id, or name a shelter that does not exist are
+    skipped and reported with their line number before the batch is
+    inserted; a batch that still fails is rolled back and reported with
+    its line range before the error is raised.
+'''
+
+TABLES = {
+    'shelters': (Shelter, SHELTER_FIELDS, validate_shelter),
+    'animals': (Animal, ANIMAL_FIELDS, validate_animal)
+}
+
+DEFAULT_BATCH_SIZE = 5000
+
+# What COPY reads as NULL: only an unquoted field matches it, so the
+# quoted strings '' and '\N' stay strings
+COPY_NULL = '\\N'
+
+
+def import_file(table, path, fmt=None, batch_size=DEFAULT_BATCH_SIZE,
+                out=sys.stderr):
+    model, fields, validate = TABLES[table]
+    fmt = fmt or _format_from_path(path)
+    progress = Progress(table, out)
+    use_copy = _supports_copy()
+    skipped = 0
+    has_ids = False
+
+    def skip(line_number, errors):
+        out.write('{}:{}: skipped: {}\n'.format(path, line_number,
+                                                json.dumps(errors)))
+
+    def import_batch(batch):
+        rows = []
+        for (line_number, values), errors in zip(
+                batch, _reference_errors(model, [row for _, row in batch])):
+            if errors:
+                skip(line_number, errors)
+            else:
+                rows.append(values)
+        if rows:
+            try:
+                _insert_batch(model, rows, use_copy)
+            except SQLAlchemyError:
+                db.session.rollback()
+                out.write('{}:{}-{}: failed, the {} rows before line {} '
+                          'were imported\n'.format(
+                              path, batch[0][0], batch[-1][0],
+                              progress.rows, batch[0][0]))
+                raise
+            progress.add(len(rows))
+        return len(batch) - len(rows)
+
+    with open(path, newline='') as f:
+        batch = []
+        for line_number, item in _read(f, fmt):
+            if fmt == 'csv':
+                item = _coerce_csv(item, fields)
+            values, errors = validate(item)
+            if not errors:
+                errors = _take_id(item, values)
+            if errors:
+                skipped += 1
+                skip(line_number, errors)
+                continue
+            has_ids = has_ids or 'id' in values
+            batch.append((line_number, values))
+
+            if len(batch) >= batch_size:
+                skipped += import_batch(batch)
+                batch = []
+
+        if batch:
+            skipped += import_batch(batch)
+
+    if has_ids:
+        _reset_sequence(model)
+    progress.done('imported', skipped)
+    return progress.rows, skipped
+
+
+def export_file(table, path, fmt=None, batch_size=DEFAULT_BATCH_SIZE,
+                out=sys.stderr):
+    model = TABLES[table][0]
+    fmt = fmt or _format_from_path(path)
+    progress = Progress(table, out)
+    columns = ['id'] + list(TABLES[table][1])
+
+    statement = select([model.__table__.c[name] for name in columns]) \
+        .order_by(model.__table__.c.id) \
+        .execution_options(stream_results=True)
+    result = db.session.execute(statement)
+
+    with open(path, 'w', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(columns, row))) + '\n'
+                             for row in rows)
+            progress.add(len(rows))
+
+    result.close()
+    progress.done('exported')
+    return progress.rows
+
+
+'''
+geocode_file(path)
+    fills in the latitude and longitude of shelters from a local
+    geocoding table: a CSV with city, state, latitude and longitude
+    columns, such as a gazetteer of city centres. Shelters are matched on
+    city and state (case-insensitive); only shelters without coordinates
+    are updated unless `overwrite` is set.
+'''
+
+
+def geocode_file(path, overwrite=False, batch_size=DEFAULT_BATCH_SIZE,
+                 out=sys.stderr):
+    places = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            try:
+                position = (float(row['latitude']), float(row['longitude']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            places[_place_key(row.get('city'), row.get('state'))] = position
+
+    shelters = Shelter.__table__
+    statement = shelters.update() \
+        .where(shelters.c.id == bindparam('shelter_id')) \
+        .values(latitude=bindparam('lat'), longitude=bindparam('lon'),
+                geohash=bindparam('hash'), updated_at=bindparam('now'))
+    progress = Progress('shelters', out)
+    unmatched = 0
+    last_id = 0
+
+    while True:
+        query = select([shelters.c.id, shelters.c.city, shelters.c.state]) \
+            .where(shelters.c.id > last_id) \
+            .order_by(shelters.c.id).limit(batch_size)
+        if not overwrite:
+            query = query.where(shelters.c.latitude.is_(None))
+        rows = db.session.execute(query).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        now = datetime.utcnow()
+        updates = []
+        for row in rows:
+            position = places.get(_place_key(row.city, row.state))
+            if position is None:
+                unmatched += 1
+                continue
+            updates.append({'shelter_id': row.id, 'lat': position[0],
+                            'lon': position[1],
+                            'hash': geohash_for(*position), 'now': now})
+        if updates:
+            db.session.execute(statement, updates)
+            mark_catalog_changed(tables=['shelters'])
+            db.session.commit()
+            progress.add(len(updates))
+
+    progress.done('geocoded', unmatched)
+    return progress.rows, unmatched
+
+
+def _place_key(city, state):
+    return ((city or '').strip().lower(), (state or '').strip().lower())
+
+
+class Progress:
+
+    def __init__(self, table, out):
+        self.table = table
+        self.out = out
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def add(self, rows):
+        self.rows += rows
+        self.out.write('{}: {} rows ({:.0f} rows/s)\n'.format(
+            self.table, self.rows, self.rate()))
+
+    def done(self, verb, skipped=0):
+        self.out.write('{}: {} {} rows in {:.1f}s ({:.0f} rows/s){}\n'.format(
+            self.table, verb, self.rows, time.monotonic() - self.started,
+            self.rate(),
+            ', skipped {}'.format(skipped) if skipped else ''))
+
+
+def _format_from_path(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    raise ValueError('Cannot tell the format of {}, pass --format'.format(
+        path))
+
+
+def _read(f, fmt):
+    if fmt == 'csv':
+        # Line 1 is the header
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            yield line_number, row
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(f, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError:
+                    yield line_number, None
+    else:
+        raise ValueError('Unknown format: {}'.format(fmt))
+
+
+def _coerce_csv(row, fields):
+    item = dict(row)
+    for name, (kind, _) in fields.items():
+        value = item.get(name)
+        if value == '':
+            item[name] = None
+        elif kind in (int, float) and value is not None:
+            try:
+                item[name] = kind(value)
+            except ValueError:
+                pass
+    return item
+
+
+def _take_id(item, values):
+    '''moves the row's own `id` into values; {field: message} when it is
+    not a positive integer'''
+    value = item.get('id')
+    if value is None or value == '':
+        return {}
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            pass
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        return {'id': 'Expected a positive integer.'}
+    values['id'] = value
+    return {}
+
+
+'''
+_reference_errors(model, rows)
+    {field: message} for each row, empty unless its id is taken (by the
+    table or an earlier row of the batch) or it names a shelter that does
+    not exist; checked before the insert, so one bad row cannot fail its
+    batch
+'''
+
+
+def _reference_errors(model, rows):
+    taken = _existing_ids(model, [row['id'] for row in rows if 'id' in row])
+    shelters = set()
+    if model is Animal:
+        shelters = _existing_ids(Shelter, {
+            row['shelter_id'] for row in rows
+            if row.get('shelter_id') is not None})
+
+    errors = []
+    for row in rows:
+        row_errors = {}
+        if 'id' in row:
+            if row['id'] in taken:
+                row_errors['id'] = 'Id {} is taken.'.format(row['id'])
+            taken.add(row['id'])
+        if model is Animal and row.get('shelter_id') is not None and \
+                row['shelter_id'] not in shelters:
+            row_errors['shelter_id'] = 'No shelter with id {}.'.format(
+                row['shelter_id'])
+        errors.append(row_errors)
+    return errors
+
+
+def _existing_ids(model, ids):
+    table = model.__table__
+    ids = list(ids)
+    existing = set()
+    # Older SQLite versions bind at most 999 parameters per statement
+    for start in range(0, len(ids), 500):
+        existing.update(row.id for row in db.session.execute(
+            select([table.c.id]).where(table.c.id.in_(
+                ids[start:start + 500]))))
+    return existing
+
+
+def _supports_copy():
+    engine = db.session.get_bind()
+    return engine.dialect.name == 'postgresql' and \
+        engine.dialect.driver == 'psycopg2'
+
+
+def _insert_batch(model, rows, use_copy):
+    updated_at = datetime.utcnow()
+    if model is Shelter:
+        rows = [with_geohash(row) for row in rows]
+    for row in rows:
+        row['updated_at'] = updated_at
+
+    # Every statement needs one column list: rows that carry their own id
+    # go in separately from rows that take one from the sequence
+    for group in ([row for row in rows if 'id' in row],
+                  [row for row in rows if 'id' not in row]):
+        if not group:
+            continue
+        if use_copy:
+            _copy_batch(model, group)
+        else:
+            db.session.execute(model.__table__.insert(), group)
+    if model is Animal:
+        apply_stats_deltas(stats_deltas(rows))
+    mark_catalog_changed(tables=[model.__tablename__])
+    db.session.commit()
+
+
+def _copy_batch(model, rows):
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(copy_line([row[name] for name in columns]))
+    buffer.seek(0)
+
+    with db.session.connection().connection.cursor() as cursor:
+        cursor.copy_expert(
+            "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '{}')".format(
+                model.__tablename__, ', '.join(columns), COPY_NULL), buffer)
+
+
+def copy_line(values):
+    '''one row of COPY ... FORMAT csv input, strings always quoted'''
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append(COPY_NULL)
+        elif isinstance(value, bool):
+            fields.append('true' if value else 'false')
+        elif isinstance(value, (int, float)):
+            fields.append(repr(value))
+        else:
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            fields.append('"{}"'.format(str(value).replace('"', '""')))
+    return ','.join(fields) + '\n'
+
+
+def _reset_sequence(model):
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    db.session.execute(text(
+        "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+        "(SELECT coalesce(max(id), 1) FROM {}))".format(model.__tablename__)),
+        {'table': model.__tablename__})
+    db.session.commit()
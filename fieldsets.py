@@ -0,0 +1,64 @@
+from flask import abort
+from models import Shelter, Animal
+
+
+'''
+Sparse fieldsets
+    `fields=id,name,species` on a read endpoint returns only those keys.
+    The query selects just the matching columns (with_entities), and the
+    row tuples are turned into dicts directly: no ORM objects, no identity
+    map entries, no unused columns. `id` is always included; the cursor
+    of the next page is built from it.
+'''
+
+# The keys of Shelter.format() and Animal.format(), in column order
+FIELDS = {
+    Shelter: ('id', 'name', 'city', 'state', 'address', 'phone', 'latitude',
+              'longitude'),
+    Animal: ('id', 'name', 'gender', 'age', 'species', 'breed',
+             'shelter_id')
+}
+
+
+'''
+get_fields(args, *models)
+    the field names in `fields`, id first, or None when the parameter is
+    absent; every name must belong to one of `models`
+    aborts with 400 on an empty list or an unknown field
+'''
+
+
+def get_fields(args, *models):
+    value = args.get('fields')
+    if value is None:
+        return None
+
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    known = set()
+    for model in models:
+        known.update(FIELDS[model])
+    if not names or any(name not in known for name in names):
+        abort(400)
+
+    return ('id',) + tuple(dict.fromkeys(name for name in names
+                                         if name != 'id'))
+
+
+def fields_of(model, fields):
+    '''the names in `fields` that `model` has'''
+    return tuple(name for name in fields if name in FIELDS[model])
+
+
+def project(query, model, fields):
+    '''`query` selecting only the columns of `fields`'''
+    return query.with_entities(*[getattr(model, name) for name in fields])
+
+
+def row_formatter(fields):
+    return lambda row: dict(zip(fields, row))
+
+
+def trim(formatted, fields, keep=()):
+    '''an already formatted dict cut down to `fields` plus `keep`'''
+    return {key: value for key, value in formatted.items()
+            if key in fields or key in keep}
@@ -0,0 +1,46 @@
+from flask import abort
+from models import Animal
+
+
+'''
+filter_animals(query, args)
+    applies the /animals query-string filters to `query` as SQL WHERE
+    clauses; every filter is backed by one of the indexes declared on
+    Animal
+        species, breed, gender: exact match
+        min_age, max_age: inclusive age range
+        shelter_id: animals of one shelter
+    aborts with 400 on a malformed number or an empty age range
+'''
+
+
+def filter_animals(query, args):
+    for name in ('species', 'breed', 'gender'):
+        value = args.get(name)
+        if value:
+            query = query.filter(getattr(Animal, name) == value)
+
+    min_age = _int_arg(args, 'min_age')
+    max_age = _int_arg(args, 'max_age')
+    if min_age is not None and max_age is not None and min_age > max_age:
+        abort(400)
+    if min_age is not None:
+        query = query.filter(Animal.age >= min_age)
+    if max_age is not None:
+        query = query.filter(Animal.age <= max_age)
+
+    shelter_id = _int_arg(args, 'shelter_id')
+    if shelter_id is not None:
+        query = query.filter(Animal.shelter_id == shelter_id)
+
+    return query
+
+
+def _int_arg(args, name):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
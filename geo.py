@@ -0,0 +1,126 @@
+import math
+
+
+'''
+Geohash
+    a geohash names a cell of a latitude/longitude grid; cells that share
+    a prefix are inside the same larger cell, so the shelters within a
+    cell are a range of a B-tree index on the geohash column.
+
+    covering_ranges(lat, lon, radius_km) returns the ranges of the 3x3
+    block of cells around a point, with cells chosen just large enough
+    for the block to contain the whole circle. Those rows are the only
+    candidates a nearest-shelter query has to measure.
+'''
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Stored hashes have this many characters, a cell of about 5 by 5 metres
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        interval, value = (lon_range, lon) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def decode(geohash):
+    '''returns the (lat, lon) centre and (lat, lon) half size of the cell'''
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if bits >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return (((lat_range[0] + lat_range[1]) / 2,
+             (lon_range[0] + lon_range[1]) / 2),
+            ((lat_range[1] - lat_range[0]) / 2,
+             (lon_range[1] - lon_range[0]) / 2))
+
+
+def cell_size(precision):
+    '''(lat, lon) degrees covered by a cell of `precision` characters'''
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def neighbors(geohash):
+    '''the cell and its eight neighbours, without duplicates'''
+    (lat, lon), (lat_half, lon_half) = decode(geohash)
+    cells = []
+    for dlat in (-1, 0, 1):
+        cell_lat = lat + 2 * lat_half * dlat
+        if not -90 < cell_lat < 90:
+            continue
+        for dlon in (-1, 0, 1):
+            cell_lon = (lon + 2 * lon_half * dlon + 180) % 360 - 180
+            cell = encode(cell_lat, cell_lon, len(geohash))
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def covering_precision(lat, radius_km):
+    '''
+    the longest prefix whose cells are at least radius_km tall and wide
+    at `lat`, or 0 when even a one-character cell is too small
+    '''
+    # Cells narrow towards the poles: measure at the edge of the circle
+    edge = min(89.9, abs(lat) + radius_km / KM_PER_DEGREE)
+    km_per_lon_degree = KM_PER_DEGREE * math.cos(math.radians(edge))
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_degrees, lon_degrees = cell_size(precision)
+        if lat_degrees * KM_PER_DEGREE >= radius_km and \
+                lon_degrees * km_per_lon_degree >= radius_km:
+            return precision
+    return 0
+
+
+def covering_ranges(lat, lon, radius_km):
+    '''
+    inclusive (low, high) geohash ranges holding every point within
+    radius_km of (lat, lon); None when the circle is too large to narrow
+    '''
+    precision = covering_precision(lat, radius_km)
+    if precision == 0:
+        return None
+    padding = GEOHASH_PRECISION - precision
+    return [(cell + BASE32[0] * padding, cell + BASE32[-1] * padding)
+            for cell in sorted(neighbors(encode(lat, lon, precision)))]
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    '''great-circle distance (haversine)'''
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * \
+        math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,54 @@
+import logging
+import os
+
+
+'''
+gunicorn settings
+    GUNICORN_WORKER_CLASS picks the serving mode:
+        gthread (default): each worker serves GUNICORN_THREADS requests at
+            once, so a request waiting on Postgres or the identity
+            provider no longer blocks the whole worker
+        gevent: cooperative concurrency, GUNICORN_WORKER_CONNECTIONS
+            requests per worker; psycopg2 is made cooperative with
+            psycogreen after the fork
+        sync: one request at a time per worker (the old behaviour)
+    WEB_CONCURRENCY sets the number of workers. The database pool of each
+    worker is sized from the same settings, see pooling.py.
+'''
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '8080'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+# The app must be loaded after gevent has patched the worker
+preload_app = False
+
+# pooling.pool_sizes reads these to size each worker's database pool,
+# pooling.worker_concurrency to size the load shedder (see ratelimit.py)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+os.environ['GUNICORN_WORKER_CLASS'] = worker_class
+if worker_class == 'gevent':
+    # Greenlets are cheap, connections are not: cap the pool and let the
+    # rest queue on it
+    os.environ.setdefault('DB_POOL_SIZE', '10')
+    os.environ['GUNICORN_WORKER_CONNECTIONS'] = str(worker_connections)
+else:
+    os.environ['GUNICORN_THREADS'] = str(
+        threads if worker_class == 'gthread' else 1)
+
+
+def post_fork(server, worker):
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        logging.getLogger('gunicorn.error').warning(
+            'psycogreen is not installed, database calls will block the '
+            'gevent worker')
+        return
+    patch_psycopg()
@@ -1,8 +1,10 @@
-from flask_script import Manager
+from flask_script import Command, Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from app import create_app
-from models import db
+from models import db, rebuild_animal_stats
+from data_transfer import (DEFAULT_BATCH_SIZE, export_file, geocode_file,
+                           import_file)
 
 app = create_app()
 migrate = Migrate(app, db)
@@ -11,5 +13,47 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('path', help='CSV or NDJSON file to read')
+@manager.option('table', choices=['shelters', 'animals'])
+@manager.option('--format', dest='fmt', choices=['csv', 'ndjson'],
+                help='file format, guessed from the extension by default')
+@manager.option('--batch-size', dest='batch_size', type=int,
+                default=DEFAULT_BATCH_SIZE)
+def import_data(table, path, fmt=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Import shelters or animals from a CSV or NDJSON file"""
+    import_file(table, path, fmt, batch_size)
+
+
+@manager.option('path', help='CSV or NDJSON file to write')
+@manager.option('table', choices=['shelters', 'animals'])
+@manager.option('--format', dest='fmt', choices=['csv', 'ndjson'],
+                help='file format, guessed from the extension by default')
+@manager.option('--batch-size', dest='batch_size', type=int,
+                default=DEFAULT_BATCH_SIZE)
+def export_data(table, path, fmt=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Export shelters or animals to a CSV or NDJSON file"""
+    export_file(table, path, fmt, batch_size)
+
+
+@manager.option('path', help='CSV of city, state, latitude, longitude')
+@manager.option('--overwrite', action='store_true',
+                help='also update shelters that have coordinates')
+@manager.option('--batch-size', dest='batch_size', type=int,
+                default=DEFAULT_BATCH_SIZE)
+def geocode_shelters(path, overwrite=False, batch_size=DEFAULT_BATCH_SIZE):
+    """Set shelter coordinates from a local geocoding table"""
+    geocode_file(path, overwrite, batch_size)
+
+
+class RebuildStats(Command):
+    """Recount the animal_stats summary table from animals"""
+
+    def run(self):
+        rebuild_animal_stats()
+        db.session.commit()
+
+
+manager.add_command('rebuild_stats', RebuildStats())
+
 if __name__ == '__main__':
     manager.run()
\ No newline at end of file
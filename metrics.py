@@ -0,0 +1,402 @@
+import os
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+'''
+Request and SQL instrumentation
+    a small in-process metrics registry rendered in the Prometheus text
+    format on /metrics. Every gunicorn worker keeps its own numbers, so
+    scrape each worker or aggregate per instance.
+
+    - per-route latency histograms, status counts, in-flight requests
+    - queries and SQL time per request, from the cursor execute events of
+      every engine
+    - time spent in each step of requires_auth
+    - the token cache, response cache, connection pool and read replica
+      counters
+
+    With debug on (or METRICS_SERVER_TIMING=true) responses also carry a
+    Server-Timing header with the same per-request breakdown.
+'''
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Metric:
+
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return ['{}{} {}'.format(self.name, self._label_text(key),
+                                 _number(value))]
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                              for name, value in pairs) + '}'
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ((0,) * len(self.buckets), 0.0, 0))
+            counts = tuple(bucket_count + (value <= bound)
+                           for bound, bucket_count in zip(self.buckets,
+                                                          counts))
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = ['{}_bucket{} {}'.format(
+            self.name, self._label_text(key, [('le', _number(bound))]),
+            bucket_count) for bound, bucket_count in zip(self.buckets,
+                                                         counts)]
+        lines.append('{}_bucket{} {}'.format(
+            self.name, self._label_text(key, [('le', '+Inf')]), count))
+        lines.append('{}_sum{} {}'.format(self.name, self._label_text(key),
+                                          _number(total)))
+        lines.append('{}_count{} {}'.format(self.name, self._label_text(key),
+                                            count))
+        return lines
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+REGISTRY = []
+
+# Collectors are called at scrape time and return extra exposition lines
+COLLECTORS = []
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests served.',
+                   ('method', 'route', 'status'))
+REQUEST_LATENCY = Histogram('http_request_duration_seconds',
+                            'Time to produce an HTTP response.',
+                            ('method', 'route'))
+IN_FLIGHT = Gauge('http_requests_in_flight',
+                  'HTTP requests being processed.')
+REQUEST_QUERIES = Histogram('http_request_db_queries',
+                            'SQL statements executed per HTTP request.',
+                            ('method', 'route'), QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram('http_request_db_duration_seconds',
+                            'Time spent in SQL per HTTP request.',
+                            ('method', 'route'))
+QUERIES = Counter('db_queries_total', 'SQL statements executed.')
+QUERY_TIME = Counter('db_query_duration_seconds_total',
+                     'Time spent executing SQL statements.')
+AUTH_STEP_TIME = Histogram('auth_step_duration_seconds',
+                           'Time spent in each step of requires_auth.',
+                           ('step',))
+
+
+'''
+SQL timing
+    every statement on every engine is counted; inside a request it is
+    also added to that request's totals in `g`. A statement that raises
+    never reaches after_cursor_execute, handle_error times it instead.
+'''
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    _record_query(conn)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # Errors raised outside a statement (connecting, committing) have no
+    # start time to pop
+    conn = context.connection
+    if conn is not None and context.statement is not None and \
+            conn.info.get('query_started'):
+        _record_query(conn)
+
+
+def _record_query(conn):
+    started = conn.info['query_started'].pop()
+    elapsed = time.perf_counter() - started
+    QUERIES.inc()
+    QUERY_TIME.inc(elapsed)
+    if has_request_context() and 'metrics_started' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+
+'''
+timed_auth_step(step)
+    context manager timing one step of requires_auth
+'''
+
+
+class timed_auth_step:
+
+    def __init__(self, step):
+        self.step = step
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        AUTH_STEP_TIME.observe(elapsed, step=self.step)
+        if has_request_context() and 'metrics_started' in g:
+            g.auth_seconds[self.step] = \
+                g.auth_seconds.get(self.step, 0.0) + elapsed
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collector in COLLECTORS:
+        lines.extend(collector())
+    return '\n'.join(lines) + '\n'
+
+
+def stat_lines(name, description, kind, samples, label=None):
+    '''
+    exposition lines for values read from elsewhere at scrape time
+    samples: {label value: number}, or a single number when label is None
+    '''
+    lines = ['# HELP {} {}'.format(name, description),
+             '# TYPE {} {}'.format(name, kind)]
+    if label is None:
+        lines.append('{} {}'.format(name, _number(samples)))
+    else:
+        for value, number in sorted(samples.items()):
+            lines.append('{}{{{}="{}"}} {}'.format(
+                name, label, _escape(value), _number(number)))
+    return lines
+
+
+'''
+setup_metrics(app)
+    installs the request hooks and the /metrics endpoint; the Server-Timing
+    header is configured from METRICS_SERVER_TIMING in the app config
+    first, then the environment
+'''
+
+
+def setup_metrics(app):
+    def setting(name, default=None):
+        return app.config.get(name, os.environ.get(name, default))
+
+    server_timing = str(setting('METRICS_SERVER_TIMING', '')).lower() in \
+        ('1', 'true', 'yes')
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+        g.auth_seconds = {}
+        IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'metrics_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUESTS.inc(method=request.method, route=route,
+                     status=response.status_code)
+        REQUEST_LATENCY.observe(elapsed, method=request.method, route=route)
+        REQUEST_QUERIES.observe(g.db_queries, method=request.method,
+                                route=route)
+        REQUEST_DB_TIME.observe(g.db_seconds, method=request.method,
+                                route=route)
+        if server_timing or app.debug:
+            response.headers['Server-Timing'] = server_timing_header(elapsed)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if g.pop('metrics_started', None) is not None:
+            IN_FLIGHT.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(
+            render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def server_timing_header(elapsed):
+    parts = ['db;dur={:.2f};desc="{} queries"'.format(g.db_seconds * 1000,
+                                                      g.db_queries)]
+    for step, seconds in g.auth_seconds.items():
+        parts.append('auth-{};dur={:.2f}'.format(step, seconds * 1000))
+    parts.append('total;dur={:.2f}'.format(elapsed * 1000))
+    return ', '.join(parts)
+
+
+def _collect_token_cache():
+    from auth.auth import token_cache
+    stats = token_cache.stats()
+    return (stat_lines('auth_token_cache_hits_total',
+                       'Bearer tokens served from the verified-token cache.',
+                       'counter', stats['hits']) +
+            stat_lines('auth_token_cache_misses_total',
+                       'Bearer tokens that needed a signature check.',
+                       'counter', stats['misses']) +
+            stat_lines('auth_token_cache_evictions_total',
+                       'Verified tokens evicted from the cache.',
+                       'counter', stats['evictions']) +
+            stat_lines('auth_token_cache_size',
+                       'Verified tokens currently cached.',
+                       'gauge', stats['size']))
+
+
+def _collect_response_cache():
+    from flask import current_app
+    cache = current_app.extensions.get('response_cache')
+    if cache is None:
+        return []
+    stats = cache.stats()
+    return (stat_lines('response_cache_hits_total',
+                       'Responses served from the response cache.',
+                       'counter', stats['hits']) +
+            stat_lines('response_cache_misses_total',
+                       'Cacheable responses that had to be built.',
+                       'counter', stats['misses']) +
+            stat_lines('response_cache_invalidations_total',
+                       'Response cache invalidations after writes.',
+                       'counter', stats['invalidations']))
+
+
+def _collect_pools():
+    from pooling import pool_stats
+    snapshots = {name: stats.snapshot() for name, stats in pool_stats.items()}
+    if not snapshots:
+        return []
+
+    def samples(field):
+        return {name: snapshot[field]
+                for name, snapshot in snapshots.items()}
+
+    return (stat_lines('db_pool_checkouts_total',
+                       'Connections checked out of the pool.',
+                       'counter', samples('checkouts'), 'pool') +
+            stat_lines('db_pool_checkout_waits_total',
+                       'Checkouts that waited for a connection.',
+                       'counter', samples('waits'), 'pool') +
+            stat_lines('db_pool_checkout_wait_seconds_total',
+                       'Time spent waiting for a connection.',
+                       'counter', samples('wait_seconds_total'), 'pool') +
+            stat_lines('db_pool_checkout_wait_seconds_max',
+                       'Longest wait for a connection.',
+                       'gauge', samples('wait_seconds_max'), 'pool') +
+            stat_lines('db_pool_checkout_timeouts_total',
+                       'Checkouts that gave up waiting for a connection.',
+                       'counter', samples('timeouts'), 'pool'))
+
+
+def _collect_replica():
+    from flask import current_app
+    replica = current_app.extensions.get('db_replica')
+    if replica is None:
+        return []
+    return (stat_lines('db_replica_up',
+                       'Whether reads are being sent to the replica.',
+                       'gauge', 0 if replica.is_down() else 1) +
+            stat_lines('db_replica_fallbacks_total',
+                       'Read-only requests served by the primary instead.',
+                       'counter', replica.fallbacks))
+
+
+def _collect_rate_limit():
+    from flask import current_app
+    lines = []
+    limiter = current_app.extensions.get('rate_limiter')
+    if limiter is not None:
+        lines += stat_lines('rate_limited_total',
+                            'Requests refused with 429 by the rate limiter.',
+                            'counter', limiter.limited)
+    shedder = current_app.extensions.get('load_shedder')
+    if shedder is not None:
+        lines += (stat_lines('load_shed_total',
+                             'Requests refused with 503 at capacity.',
+                             'counter', shedder.shed) +
+                  stat_lines('load_shed_max_in_flight',
+                             'Requests a worker handles at once.',
+                             'gauge', shedder.max_in_flight))
+    return lines
+
+
+COLLECTORS.extend([_collect_token_cache, _collect_response_cache,
+                   _collect_pools, _collect_replica, _collect_rate_limit])
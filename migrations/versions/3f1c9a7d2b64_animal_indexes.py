@@ -0,0 +1,33 @@
+"""add indexes for animal filters
+
+Revision ID: 3f1c9a7d2b64
+Revises: 48880e43282e
+Create Date: 2026-10-18 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b64'
+down_revision = '48880e43282e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_animals_species_age', 'animals',
+                    ['species', 'age'], unique=False)
+    op.create_index('ix_animals_species_breed', 'animals',
+                    ['species', 'breed'], unique=False)
+    op.create_index('ix_animals_shelter_id_id', 'animals',
+                    ['shelter_id', 'id'], unique=False)
+    op.create_index('ix_animals_age', 'animals', ['age'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_animals_age', table_name='animals')
+    op.drop_index('ix_animals_shelter_id_id', table_name='animals')
+    op.drop_index('ix_animals_species_breed', table_name='animals')
+    op.drop_index('ix_animals_species_age', table_name='animals')
@@ -0,0 +1,43 @@
+"""animal_stats summary table
+
+Revision ID: 5c8a1e7f3d92
+Revises: 9b2e4d6f1a07
+Create Date: 2026-10-18 15:02:47.613204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c8a1e7f3d92'
+down_revision = '9b2e4d6f1a07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'animal_stats',
+        sa.Column('shelter_id', sa.Integer(), nullable=False),
+        sa.Column('species', sa.String(), nullable=False),
+        sa.Column('breed', sa.String(), nullable=False),
+        sa.Column('age_bucket', sa.String(), nullable=False),
+        sa.Column('animal_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('shelter_id', 'species', 'breed',
+                                'age_bucket'))
+    # Same grouping as models.rebuild_animal_stats
+    op.execute(
+        "INSERT INTO animal_stats "
+        "(shelter_id, species, breed, age_bucket, animal_count) "
+        "SELECT shelter_id, species, breed, age_bucket, count(*) FROM ("
+        "SELECT coalesce(shelter_id, 0) AS shelter_id, "
+        "coalesce(species, '') AS species, coalesce(breed, '') AS breed, "
+        "CASE WHEN age IS NULL THEN 'unknown' WHEN age <= 1 THEN '0-1' "
+        "WHEN age <= 4 THEN '2-4' WHEN age <= 9 THEN '5-9' ELSE '10+' END "
+        "AS age_bucket FROM animals) AS keys "
+        "GROUP BY shelter_id, species, breed, age_bucket")
+
+
+def downgrade():
+    op.drop_table('animal_stats')
@@ -0,0 +1,67 @@
+"""full-text search on animals and shelters
+
+Revision ID: 7d3f9b2c4e61
+Revises: 5c8a1e7f3d92
+Create Date: 2026-10-18 16:21:09.402518
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3f9b2c4e61'
+down_revision = '5c8a1e7f3d92'
+branch_labels = None
+depends_on = None
+
+# Searchable columns, most important first (models.SEARCH_COLUMNS)
+SEARCH_COLUMNS = {
+    'animals': ('name', 'breed', 'species'),
+    'shelters': ('name', 'city')
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for table, columns in SEARCH_COLUMNS.items():
+        if dialect == 'postgresql':
+            # A generated column fills itself for the existing rows
+            vector = ' || '.join(
+                "setweight(to_tsvector('english', coalesce({}, '')), "
+                "'{}')".format(column, weight)
+                for column, weight in zip(columns, 'ABC'))
+            op.execute('ALTER TABLE {} ADD COLUMN search_vector tsvector '
+                       'GENERATED ALWAYS AS ({}) STORED'.format(table, vector))
+            op.execute('CREATE INDEX ix_{0}_search_vector ON {0} USING gin '
+                       '(search_vector)'.format(table))
+        elif dialect == 'sqlite':
+            fts = table + '_fts'
+            names = ', '.join(columns)
+            delete = "INSERT INTO {0} ({0}, rowid, {1}) VALUES ('delete', " \
+                "old.id, {2});".format(
+                    fts, names, ', '.join('old.' + c for c in columns))
+            insert = 'INSERT INTO {} (rowid, {}) VALUES (new.id, {});'.format(
+                fts, names, ', '.join('new.' + c for c in columns))
+            op.execute("CREATE VIRTUAL TABLE {} USING fts5({}, content='{}', "
+                       "content_rowid='id')".format(fts, names, table))
+            op.execute('CREATE TRIGGER {0}_ai AFTER INSERT ON {1} BEGIN {2} '
+                       'END'.format(fts, table, insert))
+            op.execute('CREATE TRIGGER {0}_ad AFTER DELETE ON {1} BEGIN {2} '
+                       'END'.format(fts, table, delete))
+            op.execute('CREATE TRIGGER {0}_au AFTER UPDATE OF {1} ON {2} '
+                       'BEGIN {3} {4} END'.format(fts, names, table, delete,
+                                                  insert))
+            op.execute("INSERT INTO {0} ({0}) VALUES ('rebuild')".format(fts))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table in SEARCH_COLUMNS:
+        if dialect == 'postgresql':
+            op.execute('DROP INDEX ix_{}_search_vector'.format(table))
+            op.execute('ALTER TABLE {} DROP COLUMN search_vector'.format(
+                table))
+        elif dialect == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute('DROP TRIGGER {}_fts_{}'.format(table, suffix))
+            op.execute('DROP TABLE {}_fts'.format(table))
@@ -0,0 +1,33 @@
+"""add updated_at to shelters and animals
+
+Revision ID: 9b2e4d6f1a07
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-18 11:40:05.218730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e4d6f1a07'
+down_revision = '3f1c9a7d2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows get the epoch, every later write sets the real time
+    for table in ('shelters', 'animals'):
+        op.add_column(table, sa.Column(
+            'updated_at', sa.DateTime(), nullable=False,
+            server_default='1970-01-01 00:00:00'))
+        op.create_index('ix_{}_updated_at'.format(table), table,
+                        ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('animals', 'shelters'):
+        op.drop_index('ix_{}_updated_at'.format(table), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
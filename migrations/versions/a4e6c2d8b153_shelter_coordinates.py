@@ -0,0 +1,36 @@
+"""latitude, longitude and geohash on shelters
+
+Revision ID: a4e6c2d8b153
+Revises: 7d3f9b2c4e61
+Create Date: 2026-10-18 17:48:33.129804
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e6c2d8b153'
+down_revision = '7d3f9b2c4e61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `python manage.py geocode_shelters`
+    op.add_column('shelters', sa.Column('latitude', sa.Float(),
+                                        nullable=True))
+    op.add_column('shelters', sa.Column('longitude', sa.Float(),
+                                        nullable=True))
+    op.add_column('shelters', sa.Column('geohash', sa.String(length=12),
+                                        nullable=True))
+    op.create_index('ix_shelters_geohash', 'shelters', ['geohash'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shelters_geohash', table_name='shelters')
+    # A plain DROP COLUMN (SQLite 3.35+): rebuilding the table in batch
+    # mode would drop the full-text search triggers on SQLite
+    for column in ('geohash', 'longitude', 'latitude'):
+        op.drop_column('shelters', column)
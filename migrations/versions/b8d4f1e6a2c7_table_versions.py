@@ -0,0 +1,28 @@
+"""table_versions write counters
+
+Revision ID: b8d4f1e6a2c7
+Revises: e2b7c5a9f314
+Create Date: 2026-10-18 21:12:09.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d4f1e6a2c7'
+down_revision = 'e2b7c5a9f314'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'table_versions',
+        sa.Column('table_name', sa.String(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('table_name'))
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -0,0 +1,64 @@
+"""ON DELETE SET NULL on animals.shelter_id
+
+Revision ID: e2b7c5a9f314
+Revises: a4e6c2d8b153
+Create Date: 2026-10-18 19:05:41.662190
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7c5a9f314'
+down_revision = 'a4e6c2d8b153'
+branch_labels = None
+depends_on = None
+
+# The name PostgreSQL gave the unnamed constraint of the first migration
+FK_NAME = 'animals_shelter_id_fkey'
+# SQLite constraints have no name, batch mode matches this one by convention
+SQLITE_CONVENTION = {
+    'fk': '%(table_name)s_%(column_0_name)s_fkey'
+}
+# Searchable columns of animals (models.SEARCH_COLUMNS)
+SEARCH_COLUMNS = ('name', 'breed', 'species')
+
+
+def upgrade():
+    _replace_foreign_key('SET NULL')
+
+
+def downgrade():
+    _replace_foreign_key(None)
+
+
+def _replace_foreign_key(ondelete):
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint(FK_NAME, 'animals', type_='foreignkey')
+        op.create_foreign_key(FK_NAME, 'animals', 'shelters',
+                              ['shelter_id'], ['id'], ondelete=ondelete)
+        return
+
+    # SQLite cannot alter a constraint: the table is rebuilt, which drops
+    # the full-text search triggers (migration 7d3f9b2c4e61) with it
+    with op.batch_alter_table('animals', recreate='always',
+                              naming_convention=SQLITE_CONVENTION) as batch:
+        batch.drop_constraint(FK_NAME, type_='foreignkey')
+        batch.create_foreign_key(FK_NAME, 'shelters', ['shelter_id'], ['id'],
+                                 ondelete=ondelete)
+    _create_search_triggers()
+
+
+def _create_search_triggers():
+    names = ', '.join(SEARCH_COLUMNS)
+    delete = "INSERT INTO animals_fts (animals_fts, rowid, {}) VALUES " \
+        "('delete', old.id, {});".format(
+            names, ', '.join('old.' + c for c in SEARCH_COLUMNS))
+    insert = 'INSERT INTO animals_fts (rowid, {}) VALUES (new.id, {});'.format(
+        names, ', '.join('new.' + c for c in SEARCH_COLUMNS))
+    op.execute('CREATE TRIGGER animals_fts_ai AFTER INSERT ON animals BEGIN '
+               '{} END'.format(insert))
+    op.execute('CREATE TRIGGER animals_fts_ad AFTER DELETE ON animals BEGIN '
+               '{} END'.format(delete))
+    op.execute('CREATE TRIGGER animals_fts_au AFTER UPDATE OF {} ON animals '
+               'BEGIN {} {} END'.format(names, delete, insert))
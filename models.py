@@ -1,28 +1,54 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, create_engine
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from sqlalchemy import (DDL, Column, String, Integer, Float, DateTime,
+                        ForeignKey, Index, PrimaryKeyConstraint, case, create_engine,
+                        event, func, select, text)
+from sqlalchemy.orm import Session, attributes, column_property
 import json
 import os
-from dotenv import load_dotenv
-load_dotenv('.env')
+from collections import Counter
+from datetime import datetime
+from geo import encode as geohash_encode
+from pooling import engine_options
+from replicas import RoutingSQLAlchemy, setup_replica
 
-database_path = os.environ.get('DATABASE_URL')
-
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the database URLs default to the DATABASE_URL and
+    REPLICA_DATABASE_URL settings (app config first, then the
+    environment), read when it is called
+    the connection pool is configured from the environment, see pooling.py
+    reads of @read_only views go to the replica when one is given, see
+    replicas.py
+    migrations are set up by manage.py, the web process does not need them
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, replica_path=None):
+    def setting(name):
+        return app.config.get(name, os.environ.get(name))
+
+    if database_path is None:
+        database_path = setting('DATABASE_URL')
+    if replica_path is None:
+        replica_path = setting('REPLICA_DATABASE_URL')
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
-    migrate = Migrate(app, db)
+    if database_path and database_path.startswith('sqlite'):
+        # SQLite only enforces foreign keys, and their ON DELETE rules,
+        # when asked to on every connection of this engine
+        event.listen(db.get_engine(app), 'connect',
+                     _enable_sqlite_foreign_keys)
+    setup_replica(app, db, replica_path)
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    dbapi_connection.execute('PRAGMA foreign_keys=ON')
 
 
 def db_drop_and_create_all():
@@ -30,6 +56,113 @@ def db_drop_and_create_all():
     db.create_all()
 
 
+'''
+on_catalog_change(callback)
+    registers `callback` to run after every committed transaction that
+    wrote to shelters or animals; the response cache uses it to
+    invalidate itself. ORM writes are picked up by session events, bulk
+    statements that bypass the unit of work must call
+    mark_catalog_changed(session, tables) themselves.
+'''
+
+catalog_listeners = []
+
+
+def on_catalog_change(callback):
+    catalog_listeners.append(callback)
+    return callback
+
+
+def mark_catalog_changed(session=None, tables=('animals', 'shelters')):
+    session = session or db.session()
+    session.info['catalog_changed'] = True
+    bump_table_versions(tables, session)
+
+
+def _catalog_tables(instances):
+    return {instance.__tablename__ for instance in instances
+            if isinstance(instance, (Shelter, Animal))}
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_catalog_flush(session, flush_context):
+    tables = _catalog_tables(list(session.new) + list(session.dirty))
+    deleted = _catalog_tables(session.deleted)
+    if 'shelters' in deleted:
+        # The database detaches its animals (ON DELETE SET NULL)
+        deleted.add('animals')
+    if tables or deleted:
+        mark_catalog_changed(session, tables | deleted)
+
+
+@event.listens_for(Session, 'after_bulk_update')
+@event.listens_for(Session, 'after_bulk_delete')
+def _track_catalog_bulk(context):
+    if context.mapper.class_ in (Shelter, Animal):
+        tables = {context.mapper.class_.__tablename__}
+        if context.mapper.class_ is Shelter:
+            tables.add('animals')
+        mark_catalog_changed(context.session, tables)
+
+
+'''
+TableVersion
+    a write counter per catalog table, bumped in the transaction of every
+    write to it by mark_catalog_changed. The read endpoints build their
+    ETags from it and max(updated_at), neither of which reads the table's
+    rows (see conditional.py). Writers of a table wait on its counter row
+    until the first of them commits.
+'''
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+VERSION_BUMP = text(
+    'INSERT INTO table_versions (table_name, version) '
+    'VALUES (:table_name, 1) '
+    'ON CONFLICT (table_name) '
+    'DO UPDATE SET version = table_versions.version + 1')
+
+
+def bump_table_versions(tables, session=None):
+    session = session or db.session()
+    # Sorted, so concurrent transactions lock the rows in the same order
+    for table_name in sorted(tables):
+        session.execute(VERSION_BUMP, {'table_name': table_name})
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_catalog_change(session):
+    if session.info.pop('catalog_changed', False):
+        for callback in catalog_listeners:
+            callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_catalog_change(session):
+    session.info.pop('catalog_changed', None)
+
+
+'''
+updated_at_column()
+    last write time of a row, set on every insert and update; the read
+    endpoints derive their ETags from max(updated_at) and TableVersion.
+    Rows that predate the column carry the epoch, so any later write
+    moves the maximum forward.
+'''
+
+
+def updated_at_column():
+    return Column(DateTime, nullable=False, default=datetime.utcnow,
+                  onupdate=datetime.utcnow,
+                  server_default='1970-01-01 00:00:00')
+
+
 '''
 Person
 Have title and release year
@@ -38,6 +171,11 @@ Have title and release year
 
 class Shelter(db.Model):
     __tablename__ = 'shelters'
+    __table_args__ = (
+        Index('ix_shelters_updated_at', 'updated_at'),
+        # Range scans for /shelters/nearby, see geo.covering_ranges
+        Index('ix_shelters_geohash', 'geohash'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
@@ -45,46 +183,121 @@ class Shelter(db.Model):
     state = Column(String)
     address = Column(String)
     phone = Column(String)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    # Derived from latitude and longitude on every write
+    geohash = Column(String(12))
+    updated_at = updated_at_column()
+    # Deleting a shelter leaves its animals to the foreign key's ON DELETE
+    # SET NULL instead of loading and updating them one by one
+    animals = db.relationship('Animal', backref='shelter', lazy=True,
+                              order_by='Animal.id', passive_deletes='all')
 
-    def __init__(self, name, city, state, address, phone):
+    def __init__(self, name, city, state, address, phone, latitude=None,
+                 longitude=None):
         self.name = name
         self.city = city
         self.state = state
         self.address = address
         self.phone = phone
+        self.latitude = latitude
+        self.longitude = longitude
 
-    def format(self):
-        return {
+    def format(self, include_animals=False):
+        formatted = {
           'id': self.id,
           'name': self.name,
           'city': self.city,
           'state': self.state,
           'address': self.address,
-          'phone': self.phone
+          'phone': self.phone,
+          'latitude': self.latitude,
+          'longitude': self.longitude
         }
+        if include_animals:
+            formatted['animals'] = [animal.format()
+                                    for animal in self.animals]
+        return formatted
 
     def insert(self):
         db.session.add(self)
         db.session.commit()
 
-    def delete(self):
+    '''
+    delete(cascade=False)
+        deletes the shelter with one DELETE; the database detaches its
+        animals (ON DELETE SET NULL), or with `cascade` they are deleted
+        first with one DELETE ... WHERE shelter_id
+    '''
+
+    def delete(self, cascade=False):
+        if cascade:
+            animals = Animal.__table__
+            db.session.execute(animals.delete()
+                               .where(animals.c.shelter_id == self.id))
+        move_shelter_stats(self.id, None if cascade else 0)
         db.session.delete(self)
         db.session.commit()
 
     def update(self):
         db.session.commit()
 
+    '''
+    bulk_insert(rows)
+        inserts a list of column dicts with one executemany in a single
+        transaction, without building ORM objects
+    '''
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        if rows:
+            db.session.execute(cls.__table__.insert(),
+                               [with_geohash(row) for row in rows])
+            mark_catalog_changed(tables=['shelters'])
+        db.session.commit()
+
+
+def geohash_for(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return geohash_encode(latitude, longitude)
+
+
+def with_geohash(row):
+    '''a shelter column dict with its geohash, for Core inserts'''
+    return dict(row, geohash=geohash_for(row.get('latitude'),
+                                         row.get('longitude')))
+
+
+@event.listens_for(Shelter, 'before_insert')
+@event.listens_for(Shelter, 'before_update')
+def _set_geohash(mapper, connection, shelter):
+    shelter.geohash = geohash_for(shelter.latitude, shelter.longitude)
+
 
 class Animal(db.Model):
     __tablename__ = 'animals'
+    # Back the /animals filters, keyset pagination and the shelter FK
+    __table_args__ = (
+        Index('ix_animals_species_age', 'species', 'age'),
+        Index('ix_animals_species_breed', 'species', 'breed'),
+        Index('ix_animals_shelter_id_id', 'shelter_id', 'id'),
+        Index('ix_animals_age', 'age'),
+        Index('ix_animals_updated_at', 'updated_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
     gender = Column(String)
-    age = Column(Integer)
-    species = Column(String)
-    breed = Column(String)
-    shelter_id = Column(Integer, ForeignKey('shelters.id'))
+    # The columns animal_stats groups by keep their old value when set,
+    # so an update can move the animal out of its old group
+    age = column_property(Column(Integer), active_history=True)
+    species = column_property(Column(String), active_history=True)
+    breed = column_property(Column(String), active_history=True)
+    shelter_id = column_property(
+        Column(Integer, ForeignKey('shelters.id', ondelete='SET NULL')),
+        active_history=True)
+    updated_at = updated_at_column()
 
     def __init__(self, name, gender, age, species, breed, shelter_id):
         self.name = name
@@ -115,3 +328,283 @@ class Animal(db.Model):
 
     def update(self):
         db.session.commit()
+
+    '''
+    bulk_insert(rows)
+        inserts a list of column dicts with one executemany in a single
+        transaction, without building ORM objects
+    '''
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        if rows:
+            db.session.execute(cls.__table__.insert(), rows)
+            apply_stats_deltas(stats_deltas(rows))
+            mark_catalog_changed(tables=['animals'])
+        db.session.commit()
+
+    '''
+    transfer(animal_ids, shelter_id)
+        moves the animals to another shelter with one UPDATE ... WHERE id
+        IN, in a single transaction
+    delete_many(animal_ids)
+        deletes the animals with one DELETE ... WHERE id IN
+    Both return the ids that existed. The rows are locked and read first,
+    for the animal_stats keys they leave.
+    '''
+
+    @classmethod
+    def transfer(cls, animal_ids, shelter_id):
+        table = cls.__table__
+        rows = cls._lock_stats_rows(animal_ids)
+        ids = [row['id'] for row in rows]
+        if ids:
+            # updated_at is set by the column's onupdate
+            db.session.execute(table.update().where(table.c.id.in_(ids))
+                               .values(shelter_id=shelter_id))
+            deltas = stats_deltas(rows, -1)
+            deltas.update(stats_deltas(
+                [dict(row, shelter_id=shelter_id) for row in rows]))
+            apply_stats_deltas(deltas)
+            mark_catalog_changed(tables=['animals'])
+        db.session.commit()
+        return ids
+
+    @classmethod
+    def delete_many(cls, animal_ids):
+        table = cls.__table__
+        rows = cls._lock_stats_rows(animal_ids)
+        ids = [row['id'] for row in rows]
+        if ids:
+            db.session.execute(table.delete().where(table.c.id.in_(ids)))
+            apply_stats_deltas(stats_deltas(rows, -1))
+            mark_catalog_changed(tables=['animals'])
+        db.session.commit()
+        return ids
+
+    @classmethod
+    def _lock_stats_rows(cls, animal_ids):
+        table = cls.__table__
+        return [dict(row) for row in db.session.execute(
+            select([table.c.id, table.c.shelter_id, table.c.species,
+                    table.c.breed, table.c.age])
+            .where(table.c.id.in_(animal_ids))
+            .order_by(table.c.id).with_for_update())]
+
+
+'''
+Full-text search
+    the searchable columns of each table, most important first; see
+    search.py for the queries
+        PostgreSQL: a generated tsvector column `search_vector` with a GIN
+            index, weighted A, B, C in column order
+        SQLite: an FTS5 table `<table>_fts` over the same columns, kept in
+            step with the table by triggers
+    Both are created with the tables here and by migration 7d3f9b2c4e61.
+'''
+
+SEARCH_COLUMNS = {
+    'animals': ('name', 'breed', 'species'),
+    'shelters': ('name', 'city')
+}
+
+
+def _search_vector_sql(columns):
+    return ' || '.join(
+        "setweight(to_tsvector('english', coalesce({}, '')), '{}')".format(
+            column, weight) for column, weight in zip(columns, 'ABC'))
+
+
+def search_ddl(table_name):
+    '''(create statements, drop statements) per dialect'''
+    columns = SEARCH_COLUMNS[table_name]
+    fts = table_name + '_fts'
+    names = ', '.join(columns)
+    new_values = ', '.join('new.' + column for column in columns)
+    old_values = ', '.join('old.' + column for column in columns)
+    delete = "INSERT INTO {0} ({0}, rowid, {1}) VALUES ('delete', old.id, " \
+        "{2});".format(fts, names, old_values)
+    insert = 'INSERT INTO {} (rowid, {}) VALUES (new.id, {});'.format(
+        fts, names, new_values)
+    return {
+        'postgresql': ([
+            'ALTER TABLE {} ADD COLUMN search_vector tsvector GENERATED '
+            'ALWAYS AS ({}) STORED'.format(table_name,
+                                           _search_vector_sql(columns)),
+            'CREATE INDEX ix_{0}_search_vector ON {0} USING gin '
+            '(search_vector)'.format(table_name)
+        ], []),
+        'sqlite': ([
+            "CREATE VIRTUAL TABLE {} USING fts5({}, content='{}', "
+            "content_rowid='id')".format(fts, names, table_name),
+            'CREATE TRIGGER {0}_ai AFTER INSERT ON {1} BEGIN {2} END'.format(
+                fts, table_name, insert),
+            'CREATE TRIGGER {0}_ad AFTER DELETE ON {1} BEGIN {2} END'.format(
+                fts, table_name, delete),
+            'CREATE TRIGGER {0}_au AFTER UPDATE OF {1} ON {2} BEGIN {3} '
+            '{4} END'.format(fts, names, table_name, delete, insert)
+        ], [
+            'DROP TABLE IF EXISTS {}'.format(fts)
+        ])
+    }
+
+
+for _table in (Shelter.__table__, Animal.__table__):
+    for _dialect, (_create, _drop) in search_ddl(_table.name).items():
+        for _statement in _create:
+            event.listen(_table, 'after_create',
+                         DDL(_statement).execute_if(dialect=_dialect))
+        for _statement in _drop:
+            event.listen(_table, 'after_drop',
+                         DDL(_statement).execute_if(dialect=_dialect))
+
+
+'''
+AnimalStat
+    animal counts per shelter, species, breed and age bucket, kept in step
+    with the animals table by the flush listener below, so /stats reads a
+    table whose size depends on the number of distinct groups rather than
+    on the number of animals. Missing values are stored as 0 (shelter_id)
+    and '' (species, breed) so that they can be part of the primary key.
+
+    Writes that bypass the ORM unit of work must apply their own deltas
+    (apply_stats_deltas) or rebuild the table (rebuild_animal_stats).
+'''
+
+# (highest age, bucket); older animals are '10+', unknown ages 'unknown'
+AGE_BUCKETS = ((1, '0-1'), (4, '2-4'), (9, '5-9'))
+OLDEST_AGE_BUCKET = '10+'
+UNKNOWN_AGE_BUCKET = 'unknown'
+
+
+class AnimalStat(db.Model):
+    __tablename__ = 'animal_stats'
+    __table_args__ = (
+        PrimaryKeyConstraint('shelter_id', 'species', 'breed', 'age_bucket'),
+    )
+
+    shelter_id = Column(Integer, nullable=False)
+    species = Column(String, nullable=False)
+    breed = Column(String, nullable=False)
+    age_bucket = Column(String, nullable=False)
+    animal_count = Column(Integer, nullable=False)
+
+
+def age_bucket(age):
+    if age is None:
+        return UNKNOWN_AGE_BUCKET
+    for highest, bucket in AGE_BUCKETS:
+        if age <= highest:
+            return bucket
+    return OLDEST_AGE_BUCKET
+
+
+def age_bucket_expression(age):
+    return case([(age.is_(None), UNKNOWN_AGE_BUCKET)] +
+                [(age <= highest, bucket) for highest, bucket in AGE_BUCKETS],
+                else_=OLDEST_AGE_BUCKET)
+
+
+def stats_key(shelter_id, species, breed, age):
+    return (shelter_id or 0, species or '', breed or '', age_bucket(age))
+
+
+def stats_deltas(rows, sign=1):
+    '''counts of column dicts per animal_stats key'''
+    deltas = Counter()
+    for row in rows:
+        deltas[stats_key(row.get('shelter_id'), row.get('species'),
+                         row.get('breed'), row.get('age'))] += sign
+    return deltas
+
+
+STATS_UPSERT = text(
+    'INSERT INTO animal_stats '
+    '(shelter_id, species, breed, age_bucket, animal_count) '
+    'VALUES (:shelter_id, :species, :breed, :age_bucket, :delta) '
+    'ON CONFLICT (shelter_id, species, breed, age_bucket) '
+    'DO UPDATE SET animal_count = '
+    'animal_stats.animal_count + excluded.animal_count')
+
+
+def apply_stats_deltas(deltas, session=None):
+    session = session or db.session()
+    # Sorted, so concurrent transactions lock the rows in the same order
+    params = [{'shelter_id': key[0], 'species': key[1], 'breed': key[2],
+               'age_bucket': key[3], 'delta': delta}
+              for key, delta in sorted(deltas.items()) if delta]
+    if not params:
+        return
+    session.execute(STATS_UPSERT, params)
+    if any(param['delta'] < 0 for param in params):
+        session.execute(AnimalStat.__table__.delete()
+                        .where(AnimalStat.animal_count <= 0))
+
+
+def move_shelter_stats(shelter_id, to_shelter_id=0, session=None):
+    '''
+    moves a shelter's animal_stats counts to `to_shelter_id` (0 for
+    animals without a shelter), or drops them when it is None; for
+    statements that move or delete all of a shelter's animals at once
+    '''
+    session = session or db.session()
+    deltas = Counter()
+    for stat in session.query(AnimalStat) \
+            .filter(AnimalStat.shelter_id == shelter_id):
+        deltas[(shelter_id, stat.species, stat.breed,
+                stat.age_bucket)] -= stat.animal_count
+        if to_shelter_id is not None:
+            deltas[(to_shelter_id, stat.species, stat.breed,
+                    stat.age_bucket)] += stat.animal_count
+    apply_stats_deltas(deltas, session)
+
+
+def rebuild_animal_stats(session=None):
+    '''recounts animal_stats from animals with one GROUP BY'''
+    session = session or db.session()
+    animals = Animal.__table__
+    keys = select([
+        func.coalesce(animals.c.shelter_id, 0).label('shelter_id'),
+        func.coalesce(animals.c.species, '').label('species'),
+        func.coalesce(animals.c.breed, '').label('breed'),
+        age_bucket_expression(animals.c.age).label('age_bucket')
+    ]).alias('keys')
+    counts = select([keys.c.shelter_id, keys.c.species, keys.c.breed,
+                     keys.c.age_bucket, func.count()]) \
+        .group_by(keys.c.shelter_id, keys.c.species, keys.c.breed,
+                  keys.c.age_bucket)
+
+    session.execute(AnimalStat.__table__.delete())
+    session.execute(AnimalStat.__table__.insert().from_select(
+        ['shelter_id', 'species', 'breed', 'age_bucket', 'animal_count'],
+        counts))
+
+
+def _animal_stats_key(animal, old=False):
+    values = []
+    for name in ('shelter_id', 'species', 'breed', 'age'):
+        history = attributes.get_history(animal, name)
+        if old and history.deleted:
+            values.append(history.deleted[0])
+        else:
+            values.append(getattr(animal, name))
+    return stats_key(*values)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_animal_stats(session, flush_context):
+    deltas = Counter()
+    for animal in session.new:
+        if isinstance(animal, Animal):
+            deltas[_animal_stats_key(animal)] += 1
+    for animal in session.deleted:
+        if isinstance(animal, Animal):
+            deltas[_animal_stats_key(animal, old=True)] -= 1
+    for animal in session.dirty:
+        if isinstance(animal, Animal) and animal not in session.deleted:
+            old_key = _animal_stats_key(animal, old=True)
+            new_key = _animal_stats_key(animal)
+            if old_key != new_key:
+                deltas[old_key] -= 1
+                deltas[new_key] += 1
+    apply_stats_deltas(deltas, session)
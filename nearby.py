@@ -0,0 +1,108 @@
+import os
+from flask import abort
+from sqlalchemy import func, or_
+from geo import covering_ranges, distance_km
+from models import db, AnimalStat, Shelter
+from pagination import MAX_PAGE_SIZE
+from fieldsets import get_fields, project, trim
+
+
+DEFAULT_NEARBY_RADIUS_KM = float(os.environ.get('DEFAULT_NEARBY_RADIUS_KM',
+                                                25))
+MAX_NEARBY_RADIUS_KM = float(os.environ.get('MAX_NEARBY_RADIUS_KM', 500))
+DEFAULT_NEARBY_LIMIT = 10
+
+'''
+nearby_shelters(args)
+    the shelters closest to a point, for /shelters/nearby
+        lat, lon: the point (required)
+        radius: kilometres to look within (default 25, at most
+            MAX_NEARBY_RADIUS_KM)
+        limit: shelters to return (default 10, at most MAX_PAGE_SIZE)
+        include=animal_counts: add each shelter's animal count, read from
+            the animal_stats summary table
+        fields: the shelter keys to return, see fieldsets.py
+    only shelters in the geohash cells around the point are read (an
+    index range scan), then measured and sorted by distance
+    returns the formatted shelters with their `distance_km`, nearest
+    first
+    aborts with 400 on a missing or malformed parameter
+'''
+
+
+def nearby_shelters(args):
+    lat = _float_arg(args, 'lat', -90, 90)
+    lon = _float_arg(args, 'lon', -180, 180)
+    radius = _float_arg(args, 'radius', 0, MAX_NEARBY_RADIUS_KM,
+                        DEFAULT_NEARBY_RADIUS_KM)
+    try:
+        limit = int(args.get('limit', DEFAULT_NEARBY_LIMIT))
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    include = args.get('include', '')
+    if include not in ('', 'animal_counts'):
+        abort(400)
+
+    fields = get_fields(args, Shelter)
+
+    query = Shelter.query.filter(Shelter.geohash.isnot(None))
+    if fields:
+        # The position is needed for the distance even if not returned
+        selected = fields + tuple(name for name in ('latitude', 'longitude')
+                                  if name not in fields)
+        query = project(query, Shelter, selected)
+    ranges = covering_ranges(lat, lon, radius)
+    if ranges is not None:
+        query = query.filter(or_(*[Shelter.geohash.between(low, high)
+                                   for low, high in ranges]))
+
+    candidates = []
+    for shelter in query:
+        distance = distance_km(lat, lon, shelter.latitude, shelter.longitude)
+        if distance <= radius:
+            candidates.append((distance, shelter.id, shelter))
+    candidates.sort(key=lambda candidate: candidate[:2])
+    candidates = candidates[:limit]
+
+    counts = _animal_counts([shelter.id for _, _, shelter in candidates]) \
+        if include == 'animal_counts' else None
+
+    shelters = []
+    for distance, _, shelter in candidates:
+        if fields:
+            formatted = trim(dict(zip(selected, shelter)), fields)
+        else:
+            formatted = shelter.format()
+        formatted['distance_km'] = round(distance, 3)
+        if counts is not None:
+            formatted['animal_count'] = counts.get(shelter.id, 0)
+        shelters.append(formatted)
+    return shelters
+
+
+def _animal_counts(shelter_ids):
+    if not shelter_ids:
+        return {}
+    return dict(db.session.query(AnimalStat.shelter_id,
+                                 func.sum(AnimalStat.animal_count))
+                .filter(AnimalStat.shelter_id.in_(shelter_ids))
+                .group_by(AnimalStat.shelter_id))
+
+
+def _float_arg(args, name, low, high, default=None):
+    value = args.get(name)
+    if value is None or value == '':
+        if default is None:
+            abort(400)
+        return default
+    try:
+        value = float(value)
+    except ValueError:
+        abort(400)
+    if not low <= value <= high:
+        abort(400)
+    return value
@@ -0,0 +1,85 @@
+import base64
+import binascii
+import json
+import os
+from flask import abort
+
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 200))
+
+'''
+Keyset pagination
+    pages are ordered by primary key and a page starts right after the
+    last id of the previous one, so fetching page N costs the same as
+    fetching page 1 (no OFFSET scan). The position is handed to the client
+    as an opaque `next_cursor` string.
+'''
+
+
+def encode_cursor(last_id):
+    raw = json.dumps({'id': last_id}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(padded))['id']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(last_id, int):
+        raise ValueError('Invalid cursor')
+    return last_id
+
+
+'''
+get_page_args(args)
+    reads `limit` and `cursor` from the query string
+    aborts with 400 if either is malformed, and clamps `limit` to
+    MAX_PAGE_SIZE
+    returns (limit, after_id)
+'''
+
+
+def get_page_args(args):
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    after_id = None
+    cursor = args.get('cursor')
+    if cursor:
+        try:
+            after_id = decode_cursor(cursor)
+        except ValueError:
+            abort(400)
+
+    return limit, after_id
+
+
+'''
+paginate(query, id_column, limit, after_id)
+    returns (items, next_cursor); next_cursor is None on the last page
+'''
+
+
+def paginate(query, id_column, limit, after_id=None):
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    items = query.order_by(id_column).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].id)
+
+    return items, next_cursor
+
+
+def wants_total(args):
+    return args.get('include_total', '').lower() in ('1', 'true', 'yes')
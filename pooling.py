@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+'''
+Connection pool settings
+    every gunicorn worker has its own pool, so the pool is sized per
+    worker: one connection per request thread, with overflow only when a
+    DB_MAX_CONNECTIONS budget for the whole deployment leaves room for it.
+
+    Environment:
+        WEB_CONCURRENCY: gunicorn workers per dyno (default 1)
+        GUNICORN_WORKER_CLASS: the gunicorn worker class (default gthread)
+        GUNICORN_THREADS: threads per worker (default 1)
+        GUNICORN_WORKER_CONNECTIONS: requests a gevent worker serves at
+            once (default 100)
+        DB_MAX_CONNECTIONS: connections the database allows this app in
+            total, shared by all workers (default: no budget)
+        DB_POOL_SIZE, DB_MAX_OVERFLOW: override the computed sizes
+        DB_POOL_TIMEOUT: seconds to wait for a free connection (default 10)
+        DB_POOL_RECYCLE: seconds before a connection is replaced
+            (default 1800)
+        DB_POOL_PRE_PING: test connections on checkout so a database
+            failover does not surface as errors (default true)
+        DB_EXTERNAL_POOLER: set when an external pooler such as PgBouncer
+            sits in front of the database; the app then keeps no pool
+            (NullPool) and opens a connection per checkout
+
+    A read replica (see replicas.py) gets a pool of the same size, named
+    'replica' in the pool stats.
+'''
+
+
+def engine_options(database_url, env=os.environ, name='primary'):
+    if not database_url or database_url.startswith('sqlite'):
+        # SQLite picks its own pool class, none of this applies
+        return {}
+
+    if _flag(env.get('DB_EXTERNAL_POOLER')):
+        return {'poolclass': NullPool}
+
+    pool_size, max_overflow = pool_sizes(env)
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_logging_name': name,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': float(env.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(env.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': _flag(env.get('DB_POOL_PRE_PING', 'true'))
+    }
+
+
+def pool_sizes(env=os.environ):
+    threads = max(1, int(env.get('GUNICORN_THREADS', 1)))
+    workers = max(1, int(env.get('WEB_CONCURRENCY', 1)))
+
+    pool_size = threads
+    max_overflow = 0
+    budget = env.get('DB_MAX_CONNECTIONS')
+    if budget:
+        per_worker = max(1, int(budget) // workers)
+        pool_size = min(pool_size, per_worker)
+        max_overflow = per_worker - pool_size
+
+    if env.get('DB_POOL_SIZE'):
+        pool_size = int(env['DB_POOL_SIZE'])
+    if env.get('DB_MAX_OVERFLOW'):
+        max_overflow = int(env['DB_MAX_OVERFLOW'])
+    return pool_size, max_overflow
+
+
+def worker_concurrency(env=os.environ):
+    '''requests a gunicorn worker serves at once'''
+    if env.get('GUNICORN_WORKER_CLASS') == 'gevent':
+        return max(1, int(env.get('GUNICORN_WORKER_CONNECTIONS', 100)))
+    return max(1, int(env.get('GUNICORN_THREADS', 1)))
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            # Above a millisecond the checkout had to wait for a connection
+            # to be returned or opened
+            if seconds > 0.001:
+                self.waits += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+                'timeouts': self.timeouts
+            }
+
+
+# PoolStats per pool_logging_name ('primary', 'replica', ...)
+pool_stats = {}
+_pool_stats_lock = threading.Lock()
+
+
+def stats_for(name):
+    with _pool_stats_lock:
+        if name not in pool_stats:
+            pool_stats[name] = PoolStats()
+        return pool_stats[name]
+
+
+'''
+InstrumentedQueuePool
+    a QueuePool that records how long each checkout waited for a
+    connection
+'''
+
+
+class InstrumentedQueuePool(QueuePool):
+
+    def _do_get(self):
+        stats = stats_for(self.logging_name or 'default')
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        stats.record(time.perf_counter() - started)
+        return connection
+
+    def status_snapshot(self):
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow()
+        }
@@ -0,0 +1,360 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from pooling import worker_concurrency
+
+
+logger = logging.getLogger(__name__)
+
+'''
+Rate limiting and load shedding
+    Rate limits are token buckets, one per client and route: a bucket
+    holds up to `burst` requests and refills at `rate` per period. A
+    request finding its bucket empty gets 429 with Retry-After. Clients
+    are told apart by the `sub` of their verified token on endpoints that
+    require auth (see auth.requires_auth), and by IP address elsewhere.
+    Endpoints that require auth also charge the client's IP a budget of
+    its own before the token is verified, so a flood of invalid tokens is
+    turned away before it pays for signature checks.
+
+    The buckets are kept as GCRA (generic cell rate algorithm) state: one
+    number per bucket, the time at which it would be full again, so a
+    check is a single read-modify-write, atomic in a Lua script on redis.
+
+    The load shedder caps the requests of a worker that use the database
+    at once, holding or waiting for a connection of its pool. A read
+    takes its slot when its first statement picks an engine (see
+    replicas.on_database_use), so cache hits and other responses built
+    without the database are never counted or shed; a write takes its
+    slot before the view. Past the cap a request gets 503 with
+    Retry-After at once, instead of queueing for a connection. The cap
+    defaults to the requests the worker serves at once (see
+    pooling.worker_concurrency): a gevent worker's 100 connections queue
+    on its pool of 10, as gunicorn.conf.py intends. Set it to the pool
+    size plus the queue a worker should allow to shed earlier. A request
+    that still times out waiting for a connection (DB_POOL_TIMEOUT) is
+    shed the same way.
+
+    Configured from the app config first, then the environment:
+        RATE_LIMIT_STORE: memory (default, per process), redis (shared by
+            every worker and host) or none
+        RATE_LIMIT_URL: redis:// URL of the redis store
+        RATE_LIMIT_DEFAULT: the budget of every route without a rule
+            (default 300/m:60, see parse_budget); none for no limit
+        RATE_LIMIT_RULES: per-route budgets, comma separated
+            "<METHOD> <rule>=<budget>" entries where the rule is the
+            route as declared in app.py, e.g.
+            GET /animals=10/s:20,POST /animals/bulk=1/s:2
+        RATE_LIMIT_AUTH: the per-IP budget of all endpoints that require
+            auth together, checked before the token (default 600/m:120);
+            none for no limit
+        RATE_LIMIT_PROXY_HOPS: proxies in front of the app that append
+            to X-Forwarded-For (1 on Heroku); 0 uses the peer address
+        LOAD_SHED_MAX_IN_FLIGHT: requests of a worker that use the
+            database at once (default: the worker's concurrency,
+            GUNICORN_THREADS or GUNICORN_WORKER_CONNECTIONS); 0 turns
+            shedding off
+        LOAD_SHED_RETRY_AFTER: seconds in the 503's Retry-After (default 1)
+'''
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+# Endpoints that never touch the database
+EXEMPT_ENDPOINTS = ('health', 'metrics', 'static')
+
+
+class Budget:
+
+    def __init__(self, rate, period=1, burst=None):
+        self.rate = rate
+        self.period = period
+        self.burst = burst or rate
+        # Seconds one request's token takes to come back
+        self.interval = period / rate
+
+
+'''
+parse_budget(text)
+    "<rate>/<s|m|h>[:<burst>]" as a Budget, e.g. 300/m:60 allows bursts
+    of 60 requests and 300 requests a minute on average; the burst
+    defaults to the rate. None for "none"
+    raises ValueError on a malformed budget
+'''
+
+
+def parse_budget(text):
+    text = text.strip()
+    if text == 'none':
+        return None
+    match = re.match(r'^(\d+)/([smh])(?::(\d+))?$', text)
+    if match is None or int(match.group(1)) < 1:
+        raise ValueError('Malformed rate limit budget: ' + text)
+    burst = int(match.group(3)) if match.group(3) else None
+    return Budget(int(match.group(1)), PERIODS[match.group(2)], burst)
+
+
+def parse_rules(text):
+    '''{(method, rule): Budget} from RATE_LIMIT_RULES'''
+    rules = {}
+    for entry in (text or '').split(','):
+        if not entry.strip():
+            continue
+        route, _, budget = entry.rpartition('=')
+        parts = route.split()
+        if len(parts) != 2:
+            raise ValueError('Malformed rate limit rule: ' + entry)
+        rules[(parts[0].upper(), parts[1])] = parse_budget(budget)
+    return rules
+
+
+'''
+Stores implement:
+    take(key, budget) -> seconds until the request would be allowed,
+        0 when it is allowed (and its token taken)
+'''
+
+
+class MemoryStore:
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._full_at = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, budget):
+        with self._lock:
+            now = self.clock()
+            full_at = max(self._full_at.get(key, now), now) + \
+                budget.interval
+            allowed_at = full_at - budget.burst * budget.interval
+            if now < allowed_at:
+                return allowed_at - now
+            self._full_at[key] = full_at
+            self._full_at.move_to_end(key)
+            while len(self._full_at) > self.max_keys:
+                # The least recently used bucket; if it is not full yet
+                # its client gets a few requests for free
+                self._full_at.popitem(last=False)
+            return 0
+
+
+'''
+RedisStore
+    works with any client exposing redis-py's eval, so a local stand-in
+    can replace the server in tests. The script reads the clock of the
+    server, so hosts with skewed clocks share the same buckets.
+'''
+
+GCRA_SCRIPT = '''
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local full_at = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+    + interval
+local allowed_at = full_at - burst * interval
+if now < allowed_at then
+    return tostring(allowed_at - now)
+end
+redis.call('SET', KEYS[1], tostring(full_at), 'PX',
+           math.ceil((full_at - now) * 1000))
+return '0'
+'''
+
+
+class RedisStore:
+
+    def __init__(self, client, prefix='animalrescue:ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def take(self, key, budget):
+        return float(self.client.eval(GCRA_SCRIPT, 1, self.prefix + key,
+                                      budget.interval, budget.burst))
+
+
+class RateLimiter:
+
+    def __init__(self, store, default=None, rules=None, auth=None):
+        self.store = store
+        self.default = default
+        self.rules = rules or {}
+        self.auth = auth
+        self.limited = 0
+
+    def budget_for(self, method, rule):
+        return self.rules.get((method, rule), self.default)
+
+    def check(self, method, rule, client):
+        '''raises TooManyRequests when `client` is over the route's budget'''
+        self._take('{}:{} {}'.format(client, method, rule),
+                   self.budget_for(method, rule))
+
+    def check_auth(self, client):
+        '''raises TooManyRequests when `client` is over the auth budget'''
+        self._take('{}:auth'.format(client), self.auth)
+
+    def _take(self, key, budget):
+        if budget is None:
+            return
+        try:
+            wait = self.store.take(key, budget)
+        except Exception as e:
+            # Better to serve unlimited than not at all
+            logger.warning('Rate limit store unavailable: %s', e)
+            return
+        if wait > 0:
+            self.limited += 1
+            raise TooManyRequests(retry_after=max(1, int(wait + 0.999)))
+
+
+class LoadShedder:
+
+    def __init__(self, max_in_flight, retry_after=1):
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''raises ServiceUnavailable when the worker is at capacity'''
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                raise self._reject()
+            self.in_flight += 1
+
+    def reject(self):
+        '''the ServiceUnavailable of a request shed for another reason'''
+        with self._lock:
+            return self._reject()
+
+    def _reject(self):
+        self.shed += 1
+        return ServiceUnavailable(retry_after=self.retry_after)
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def client_address(req, proxy_hops=0):
+    '''the client's IP, read from X-Forwarded-For behind `proxy_hops`'''
+    if proxy_hops and len(req.access_route) >= proxy_hops:
+        return req.access_route[-proxy_hops]
+    return req.remote_addr
+
+
+'''
+check_rate_limit(subject=None)
+    applies the budget of the current route to `subject` (a token's
+    `sub`), or to the client's IP when there is none
+'''
+
+
+def check_rate_limit(subject=None):
+    limiter = current_app.extensions.get('rate_limiter')
+    if limiter is None or request.url_rule is None:
+        return
+    if subject:
+        client = 'sub:' + subject
+    else:
+        client = _ip_client()
+    limiter.check(request.method, request.url_rule.rule, client)
+
+
+'''
+hold_load_shed_slot()
+    takes a slot of the load shedder for the current request, once:
+    before its first statement, or before the view of a write; released
+    when the request ends. Raises ServiceUnavailable when the worker is
+    at capacity.
+'''
+
+
+def hold_load_shed_slot():
+    shedder = current_app.extensions.get('load_shedder')
+    if shedder is None or 'load_shed_slot' in g:
+        return
+    shedder.acquire()
+    g.load_shed_slot = shedder
+
+
+def _ip_client():
+    return 'ip:' + str(client_address(
+        request, current_app.extensions['rate_limit_proxy_hops']))
+
+
+def _requires_auth(endpoint):
+    view = current_app.view_functions.get(endpoint)
+    return getattr(view, 'requires_auth', False)
+
+
+def setup_rate_limit(app, store=None):
+    def setting(name, default=None):
+        return app.config.get(name, os.environ.get(name, default))
+
+    if store is None:
+        kind = setting('RATE_LIMIT_STORE', 'memory')
+        if kind == 'memory':
+            store = MemoryStore()
+        elif kind == 'redis':
+            store = RedisStore.from_url(setting('RATE_LIMIT_URL'))
+        elif kind != 'none':
+            raise ValueError('Unknown RATE_LIMIT_STORE: ' + kind)
+    app.extensions['rate_limiter'] = RateLimiter(
+        store, parse_budget(setting('RATE_LIMIT_DEFAULT', '300/m:60')),
+        parse_rules(setting('RATE_LIMIT_RULES')),
+        parse_budget(setting('RATE_LIMIT_AUTH', '600/m:120'))) \
+        if store else None
+    app.extensions['rate_limit_proxy_hops'] = int(
+        setting('RATE_LIMIT_PROXY_HOPS', 0))
+
+    max_in_flight = int(setting('LOAD_SHED_MAX_IN_FLIGHT',
+                                worker_concurrency()))
+    retry_after = int(setting('LOAD_SHED_RETRY_AFTER', 1))
+    app.extensions['load_shedder'] = LoadShedder(
+        max_in_flight, retry_after) if max_in_flight > 0 else None
+
+    @app.before_request
+    def limit_request():
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return
+        # Endpoints behind requires_auth are limited per token once it is
+        # verified, and per IP before
+        if not _requires_auth(request.endpoint):
+            check_rate_limit()
+        else:
+            limiter = app.extensions.get('rate_limiter')
+            if limiter is not None:
+                limiter.check_auth(_ip_client())
+        if request.method not in ('GET', 'HEAD'):
+            # Writes always use the database; shed them here, where the
+            # views' error handling cannot turn the 503 into a 422
+            hold_load_shed_slot()
+
+    @app.teardown_request
+    def release_request(exc):
+        shedder = g.pop('load_shed_slot', None)
+        if shedder is not None:
+            shedder.release()
+
+    @app.errorhandler(PoolTimeoutError)
+    def shed_pool_timeout(error):
+        shedder = app.extensions.get('load_shedder')
+        return app.handle_http_exception(
+            shedder.reject() if shedder is not None
+            else ServiceUnavailable(retry_after=retry_after))
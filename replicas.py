@@ -0,0 +1,208 @@
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from pooling import engine_options
+
+
+logger = logging.getLogger(__name__)
+
+'''
+Read replica routing
+    with REPLICA_DATABASE_URL set, views marked @read_only run their
+    queries on a replica engine with its own connection pool, and every
+    other query goes to the primary.
+
+    The replica is skipped, and reads fall back to the primary, while it
+    is unhealthy: a failed health check or a connection error on the
+    replica takes it out for REPLICA_RETRY_AFTER seconds, and a request
+    that hit such an error is retried on the primary.
+
+    Environment:
+        REPLICA_DATABASE_URL: the replica, unset to read from the primary
+        REPLICA_HEALTH_INTERVAL: seconds between health checks (default 5)
+        REPLICA_RETRY_AFTER: seconds an unhealthy replica is left alone
+            (default 30)
+        REPLICA_MAX_LAG: on PostgreSQL, seconds of replication lag above
+            which the replica counts as unhealthy (default: not checked)
+
+    Read-your-writes: a request sending `X-Read-Your-Writes: true` reads
+    from the primary and bypasses the response cache, so a client sees
+    its own write right after making it. Other reads may trail the
+    primary by the replication lag.
+'''
+
+READ_YOUR_WRITES_HEADER = 'X-Read-Your-Writes'
+
+
+def read_your_writes(req):
+    return req.headers.get(READ_YOUR_WRITES_HEADER, '').lower() in \
+        ('1', 'true', 'yes')
+
+
+class Replica:
+
+    def __init__(self, db, engine, health_interval=5.0, retry_after=30.0,
+                 max_lag=None):
+        self.db = db
+        self.engine = engine
+        self.health_interval = health_interval
+        self.retry_after = retry_after
+        self.max_lag = max_lag
+        self.fallbacks = 0
+        self._down_until = 0.0
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        event.listen(engine, 'handle_error', self._on_error)
+
+    def available(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._down_until:
+                return False
+            if now < self._next_check:
+                return True
+            # Other threads keep using the replica while this one checks
+            self._next_check = now + self.health_interval
+
+        if self.check():
+            return True
+        self.mark_down()
+        return False
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+                if self.max_lag is not None and \
+                        self.engine.dialect.name == 'postgresql':
+                    lag = connection.execute(text(
+                        'SELECT extract(epoch FROM now() - '
+                        'pg_last_xact_replay_timestamp())')).scalar()
+                    if lag is not None and lag > self.max_lag:
+                        logger.warning('Replica is %.0fs behind', lag)
+                        return False
+        except DBAPIError as e:
+            logger.warning('Replica health check failed: %s', e)
+            return False
+        return True
+
+    def mark_down(self):
+        with self._lock:
+            self._down_until = time.monotonic() + self.retry_after
+            self._next_check = self._down_until
+
+    def is_down(self):
+        return time.monotonic() < self._down_until
+
+    def _on_error(self, context):
+        if context.is_disconnect or \
+                isinstance(context.sqlalchemy_exception, OperationalError):
+            logger.warning('Replica error, reading from the primary for '
+                           '%ss: %s', self.retry_after,
+                           context.original_exception)
+            self.mark_down()
+
+
+'''
+on_database_use(callback)
+    registers `callback` to run in a request whenever its session picks
+    the engine for a statement: before a connection is checked out, so
+    before any wait on the pool. It runs for every statement and keeps
+    its own per-request state; the load shedder uses it to count only the
+    requests that need the database.
+'''
+
+database_use_listeners = []
+
+
+def on_database_use(callback):
+    database_use_listeners.append(callback)
+    return callback
+
+
+'''
+RoutingSQLAlchemy
+    Flask-SQLAlchemy with a session that sends the queries of a @read_only
+    request to the replica engine chosen for that request
+'''
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context():
+            for callback in database_use_listeners:
+                callback()
+            engine = g.get('db_replica_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+'''
+setup_replica(app, db, database_url)
+    creates the replica engine for `app`, or disables routing when
+    database_url is empty
+'''
+
+
+def setup_replica(app, db, database_url, env=os.environ):
+    if not database_url:
+        app.extensions['db_replica'] = None
+        return None
+
+    engine = create_engine(database_url,
+                           **engine_options(database_url, env, 'replica'))
+    max_lag = env.get('REPLICA_MAX_LAG')
+    replica = Replica(
+        db, engine,
+        health_interval=float(env.get('REPLICA_HEALTH_INTERVAL', 5)),
+        retry_after=float(env.get('REPLICA_RETRY_AFTER', 30)),
+        max_lag=float(max_lag) if max_lag else None)
+    app.extensions['db_replica'] = replica
+    return replica
+
+
+'''
+@read_only
+    runs a view's queries on the replica when one is configured and
+    healthy, unless the request asked to read its own writes
+'''
+
+
+def read_only(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        replica = current_app.extensions.get('db_replica')
+        if replica is None or read_your_writes(request):
+            return f(*args, **kwargs)
+        if not replica.available():
+            replica.fallbacks += 1
+            return f(*args, **kwargs)
+
+        g.db_replica_engine = replica.engine
+        try:
+            return f(*args, **kwargs)
+        except OperationalError as e:
+            logger.warning('Read failed on the replica, retrying on the '
+                           'primary: %s', e)
+            g.pop('db_replica_engine', None)
+            replica.db.session.rollback()
+            replica.fallbacks += 1
+            return f(*args, **kwargs)
+
+    return wrapper
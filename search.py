@@ -0,0 +1,102 @@
+import re
+from flask import abort
+from sqlalchemy import and_, or_, text
+from sqlalchemy.sql import column, table
+from models import db, SEARCH_COLUMNS, Shelter, Animal
+from pagination import MAX_PAGE_SIZE
+from fieldsets import fields_of, get_fields, project, row_formatter
+
+
+'''
+search_catalog(args)
+    full-text search for /search, ranked by where the words matched (a
+    name counts more than a breed or a city)
+        q: the words to look for; every word must match, and matches the
+            start of a longer word ("lab" finds "labrador")
+        type: animals or shelters to search only one of them
+        limit: results per type (default 20, at most MAX_PAGE_SIZE)
+        fields: the keys to return (see fieldsets.py); names that only
+            one of the types has apply to that type
+    returns {'animals': [...], 'shelters': [...]}
+    aborts with 400 when q has no words or a parameter is malformed
+
+    Only letters and digits of q reach the query, so its syntax cannot
+    be injected into the tsquery or FTS5 MATCH expression.
+'''
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_TERMS = 10
+SEARCH_MODELS = {'animals': Animal, 'shelters': Shelter}
+# bm25 weights of the SQLite FTS columns, in SEARCH_COLUMNS order
+FTS_WEIGHTS = (10.0, 5.0, 2.0)
+
+
+def search_catalog(args):
+    terms = search_terms(args.get('q', ''))
+    if not terms:
+        abort(400)
+
+    try:
+        limit = int(args.get('limit', DEFAULT_SEARCH_LIMIT))
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    kind = args.get('type')
+    if kind and kind not in SEARCH_MODELS:
+        abort(400)
+    kinds = [kind] if kind else sorted(SEARCH_MODELS)
+
+    fields = get_fields(args, *SEARCH_MODELS.values())
+    dialect = db.session.get_bind().dialect.name
+    results = {}
+    for name in kinds:
+        model = SEARCH_MODELS[name]
+        query = _search(model, terms, dialect)
+        if fields:
+            model_fields = fields_of(model, fields)
+            format_row = row_formatter(model_fields)
+            results[name] = [format_row(row) for row in project(
+                query, model, model_fields).limit(limit)]
+        else:
+            results[name] = [item.format() for item in query.limit(limit)]
+    return results
+
+
+def search_terms(q):
+    return re.findall(r'\w+', q.lower())[:MAX_SEARCH_TERMS]
+
+
+def _search(model, terms, dialect):
+    table_name = model.__tablename__
+    query = model.query
+
+    if dialect == 'postgresql':
+        tsquery = "to_tsquery('english', :tsquery)"
+        query = query.filter(text('{}.search_vector @@ {}'.format(
+            table_name, tsquery))) \
+            .order_by(text('ts_rank({}.search_vector, {}) DESC'.format(
+                table_name, tsquery)), model.id) \
+            .params(tsquery=' & '.join(term + ':*' for term in terms))
+    elif dialect == 'sqlite':
+        fts_name = table_name + '_fts'
+        fts = table(fts_name, column('rowid'))
+        weights = ', '.join(
+            str(weight) for weight in
+            FTS_WEIGHTS[:len(SEARCH_COLUMNS[table_name])])
+        query = query.join(fts, fts.c.rowid == model.id) \
+            .filter(text('{} MATCH :match'.format(fts_name))) \
+            .order_by(text('bm25({}, {})'.format(fts_name, weights)),
+                      model.id) \
+            .params(match=' AND '.join('"{}"*'.format(term)
+                                       for term in terms))
+    else:
+        # No full-text index: every word must appear in some column
+        columns = [getattr(model, name) for name in SEARCH_COLUMNS[table_name]]
+        query = query.filter(and_(*[
+            or_(*[column.ilike('%{}%'.format(term)) for column in columns])
+            for term in terms])).order_by(model.id)
+
+    return query
@@ -0,0 +1,78 @@
+from flask import abort
+from sqlalchemy import func
+from models import (db, AGE_BUCKETS, OLDEST_AGE_BUCKET, UNKNOWN_AGE_BUCKET,
+                    AnimalStat)
+
+
+'''
+animal_stats(args)
+    answers /stats from the animal_stats summary table, whose size
+    depends on the number of distinct groups and not on the number of
+    animals
+        group_by: comma separated dimensions to count by together; without
+            it the counts come back for each dimension separately
+        shelter_id, species, breed, age_bucket: count only that group
+    aborts with 400 on an unknown dimension or a malformed filter
+'''
+
+DIMENSIONS = ('shelter_id', 'species', 'breed', 'age_bucket')
+AGE_BUCKET_NAMES = [bucket for _, bucket in AGE_BUCKETS] + \
+    [OLDEST_AGE_BUCKET, UNKNOWN_AGE_BUCKET]
+
+# Placeholders animal_stats stores for a missing value, reported as null
+MISSING = {'shelter_id': 0, 'species': '', 'breed': ''}
+
+
+def animal_stats(args):
+    query = _filter_stats(db.session.query(AnimalStat), args)
+    total = query.with_entities(
+        func.coalesce(func.sum(AnimalStat.animal_count), 0)).scalar()
+
+    group_by = args.get('group_by')
+    if group_by:
+        dimensions = group_by.split(',')
+        if any(name not in DIMENSIONS for name in dimensions) or \
+                len(set(dimensions)) != len(dimensions):
+            abort(400)
+        return {
+            'total_animals': total,
+            'group_by': dimensions,
+            'groups': _count_by(query, dimensions)
+        }
+
+    stats = {'total_animals': total}
+    for name in DIMENSIONS:
+        stats['by_' + name] = _count_by(query, [name])
+    return stats
+
+
+def _filter_stats(query, args):
+    for name in DIMENSIONS:
+        value = args.get(name)
+        if value is None or value == '':
+            continue
+        if name == 'shelter_id':
+            try:
+                value = int(value)
+            except ValueError:
+                abort(400)
+        elif name == 'age_bucket' and value not in AGE_BUCKET_NAMES:
+            abort(400)
+        query = query.filter(getattr(AnimalStat, name) == value)
+    return query
+
+
+def _count_by(query, dimensions):
+    columns = [getattr(AnimalStat, name) for name in dimensions]
+    count = func.sum(AnimalStat.animal_count)
+    rows = query.with_entities(*columns, count.label('count')) \
+        .group_by(*columns).order_by(count.desc(), *columns).all()
+
+    groups = []
+    for row in rows:
+        group = {}
+        for name, value in zip(dimensions, row):
+            group[name] = None if value == MISSING.get(name) else value
+        group['count'] = row[-1]
+        groups.append(group)
+    return groups
@@ -0,0 +1,50 @@
+import logging
+import os
+from flask import Response, stream_with_context
+from serialization import dumps
+
+
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+
+logger = logging.getLogger(__name__)
+
+'''
+Streaming collection responses
+    instead of formatting every row into a list and serializing it in one
+    go, the query is iterated in batches of STREAM_BATCH_SIZE rows (a
+    server-side cursor on PostgreSQL) and the JSON document is written out
+    as it goes, so a worker only ever holds one batch in memory.
+
+    The body has the same shape as the buffered response:
+        {"success": true, "<key>": [ ... ]}
+'''
+
+
+def wants_stream(args):
+    return args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def stream_collection(key, query, format_row):
+    query = query.execution_options(stream_results=True) \
+        .yield_per(STREAM_BATCH_SIZE)
+
+    def generate():
+        yield b'{"success":true,' + dumps(key) + b':['
+        separator = b''
+        chunk = []
+        try:
+            for row in query:
+                chunk.append(separator + dumps(format_row(row)))
+                separator = b','
+                if len(chunk) >= STREAM_BATCH_SIZE:
+                    yield b''.join(chunk)
+                    chunk = []
+        except Exception:
+            # The status line is already sent, all we can do is cut the
+            # document short so the client sees invalid JSON
+            logger.exception('Streaming %s failed', key)
+            raise
+        yield b''.join(chunk) + b']}'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
@@ -0,0 +1,144 @@
+import os
+
+
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 1000))
+
+'''
+Item validation for the bulk endpoints
+    each validate_* function takes one JSON item and returns
+    (values, errors): the column values to insert and a {field: message}
+    dict that is empty when the item is valid. The required fields are
+    the ones POST /shelters and POST /animals refuse to leave blank.
+'''
+
+SHELTER_FIELDS = {
+    'name': (str, True),
+    'city': (str, True),
+    'state': (str, True),
+    'address': (str, True),
+    'phone': (str, False),
+    'latitude': (float, False),
+    'longitude': (float, False)
+}
+
+COORDINATE_RANGES = {
+    'latitude': (-90, 90),
+    'longitude': (-180, 180)
+}
+
+ANIMAL_FIELDS = {
+    'name': (str, True),
+    'gender': (str, False),
+    'age': (int, False),
+    'species': (str, True),
+    'breed': (str, True),
+    'shelter_id': (int, False)
+}
+
+
+# Accepted JSON types and how to name them in an error
+KINDS = {
+    str: (str, 'a string'),
+    int: (int, 'an integer'),
+    float: ((int, float), 'a number')
+}
+
+
+def validate_shelter(item):
+    values, errors = _validate(item, SHELTER_FIELDS)
+    if values is not None and 'latitude' not in errors and \
+            'longitude' not in errors:
+        errors.update(coordinate_errors(values['latitude'],
+                                        values['longitude']))
+    return values, errors
+
+
+'''
+coordinate_errors(latitude, longitude)
+    {field: message} for a position out of range or given by half; both
+    values may be None
+'''
+
+
+def coordinate_errors(latitude, longitude):
+    errors = {}
+    for name, value in (('latitude', latitude), ('longitude', longitude)):
+        low, high = COORDINATE_RANGES[name]
+        if isinstance(value, (int, float)) and not isinstance(value, bool) \
+                and not low <= value <= high:
+            errors[name] = 'Expected a value from {} to {}.'.format(low, high)
+    if (latitude is None) != (longitude is None):
+        errors.setdefault('latitude', 'Give both latitude and longitude.')
+    return errors
+
+
+def validate_animal(item):
+    return _validate(item, ANIMAL_FIELDS)
+
+
+def _validate(item, fields):
+    if not isinstance(item, dict):
+        return None, {'item': 'Expected a JSON object.'}
+
+    values = {}
+    errors = {}
+    for name, (kind, required) in fields.items():
+        value = item.get(name)
+        if value is None or value == '':
+            if required:
+                errors[name] = 'This field is required.'
+            values[name] = value
+        elif not isinstance(value, KINDS[kind][0]) or \
+                isinstance(value, bool):
+            errors[name] = 'Expected {}.'.format(KINDS[kind][1])
+        else:
+            values[name] = value
+
+    return values, errors
+
+
+'''
+validate_ids(values)
+    the distinct ids in a JSON array or a comma separated string, in
+    order, or None unless it holds 1 to BULK_MAX_ITEMS positive integers
+'''
+
+
+def validate_ids(values):
+    if isinstance(values, str):
+        try:
+            values = [int(value) for value in values.split(',')
+                      if value.strip()]
+        except ValueError:
+            return None
+    if not isinstance(values, list) or not 0 < len(values) <= BULK_MAX_ITEMS:
+        return None
+    if any(not isinstance(value, int) or isinstance(value, bool) or
+           value < 1 for value in values):
+        return None
+    return list(dict.fromkeys(values))
+
+
+'''
+validate_items(items, validate)
+    runs `validate` over a JSON array
+    returns (rows, errors): rows is a list of (index, values) for the
+    valid items, errors a list of {'index': i, 'errors': {...}}
+    returns (None, None) when `items` is not a non-empty array of at most
+    BULK_MAX_ITEMS elements
+'''
+
+
+def validate_items(items, validate):
+    if not isinstance(items, list) or not 0 < len(items) <= BULK_MAX_ITEMS:
+        return None, None
+
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        values, item_errors = validate(item)
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+        else:
+            rows.append((index, values))
+    return rows, errors